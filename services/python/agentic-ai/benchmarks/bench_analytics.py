@@ -0,0 +1,52 @@
+"""
+Benchmark: DeviceAnalyticsStore ingestion and day/week/month queries.
+
+Usage: python benchmarks/bench_analytics.py [--events N] [--devices N] [--queries N]
+
+Fills one user's store with --events events spread evenly over the retention
+window, then times summary() for each period.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    store = main.DeviceAnalyticsStore(1, args.events, main.ANALYTICS_RETENTION_SECONDS)
+    now = time.time()
+    span = main.ANALYTICS_RETENTION_SECONDS - 3600
+    device_ids = [f"dev-{i}" for i in range(args.devices)]
+    kinds = [main.EVENT_KIND_EVENT] * 8 + [main.EVENT_KIND_COMMAND, main.EVENT_KIND_ALERT]
+
+    started = time.perf_counter()
+    for i in range(args.events):
+        ts = now - span + span * i / args.events
+        store.record("bench-user", random.choice(device_ids), random.choice(kinds), ts)
+    ingest = time.perf_counter() - started
+    print(f"ingested {args.events:,} events in {ingest:.2f}s ({args.events / ingest:,.0f} events/s)\n")
+
+    print(f"{'period':<8} {'events':>10} {'active':>7} {'alerts':>8} {'ms/query':>9}")
+    for period in main.ANALYTICS_PERIOD_SECONDS:
+        started = time.perf_counter()
+        for _ in range(args.queries):
+            summary = store.summary("bench-user", period)
+        elapsed = (time.perf_counter() - started) / args.queries
+        print(f"{period:<8} {summary['total_events']:>10,} {summary['active_devices']:>7} "
+              f"{summary['alerts']:>8,} {elapsed * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
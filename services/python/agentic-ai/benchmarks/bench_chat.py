@@ -0,0 +1,194 @@
+"""
+Benchmark suite: end-to-end AgenticAI.chat throughput and latency percentiles.
+
+Usage: python benchmarks/bench_chat.py [WORKLOAD ...] [--requests N] [--concurrency N]
+                                       [--gemini-latency-ms N] [--gemini-429-rate F] [--json PATH]
+
+device-service and Gemini are replaced by the in-process fakes in fakes.py, so
+no upstream or API key is needed. Each workload gets a fresh agent and reports
+req/s and p50/p95/p99 latency:
+
+  local        intents answered without Gemini: listing, single status, commands
+  gemini       requests that need a plan; the plan cache is off so every turn reaches the stub
+  status-10    "status of all my devices" for a home of 10 devices
+  status-100   ... 100 devices
+  status-1000  ... 1,000 devices
+  burst        --burst mixed local/Gemini requests released at the same instant
+
+Gemini admission is opened up (--gemini-rate, --gemini-burst) so the stub, not
+the production token bucket, sets the pace; pass the deployed GEMINI_RATE_PER_SECOND
+and GEMINI_BURST to measure shedding as it would happen in production. Requests that come back with an
+error (busy, upstream failure) are counted separately and still timed.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from fakes import FakeDeviceService, FakeGemini, install  # noqa: E402
+
+WORKLOADS = ["local", "gemini", "status-10", "status-100", "status-1000", "burst"]
+
+LOCAL_MESSAGES = [
+    "What devices do I have?",
+    "What's the status of the kitchen thermostat?",
+    "Is the bedroom lock locked?",
+    "Turn on the living room light",
+    "Turn off the living room light",
+    "set the kitchen thermostat to 72 degrees",
+]
+GEMINI_MESSAGES = [
+    "What should I do to get the house ready for tonight?",
+    "Make the place cozy for a movie night",
+    "I'm heading out on vacation, anything I should change?",
+    "Why does it feel cold upstairs?",
+]
+ALL_STATUS_MESSAGE = "What's the status of all my devices?"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+async def drive(agent, messages: List[str], requests: int, concurrency: int, users: int) -> Dict:
+    """Closed loop: `concurrency` workers send `requests` chats, cycling through users and messages."""
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            user = f"bench-user-{i % users}"
+            started = time.perf_counter()
+            response = await agent.chat(user, messages[i % len(messages)], conversation_id=f"{user}-conversation")
+            latencies.append(time.perf_counter() - started)
+            if response.error:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    return {"elapsed": time.perf_counter() - started, "latencies": latencies, "errors": errors}
+
+
+async def run_workload(name: str, args) -> Dict:
+    device_count = int(name.split("-")[1]) if name.startswith("status-") else args.devices
+    service = FakeDeviceService(device_count, latency=args.device_latency_ms / 1000)
+    gemini = FakeGemini(
+        plan=[
+            {"name": "list_devices", "args": {}},
+            {"name": "get_device_status", "args": {"device_id": "dev-1"}},
+            {"name": "send_device_command", "args": {"device_id": "dev-0", "command": "turn_on"}},
+        ],
+        latency=args.gemini_latency_ms / 1000,
+        rate_limited=args.gemini_429_rate,
+        retry_after=args.gemini_retry_after,
+    )
+
+    agent = main.AgenticAI()
+    await install(agent, service, gemini)
+    agent.gemini_admission = main.GeminiAdmissionController(
+        args.gemini_rate, args.gemini_burst or max(args.concurrency, args.burst), main.GEMINI_QUEUE_MAX
+    )
+
+    requests, concurrency = args.requests, args.concurrency
+    if name == "local":
+        messages = LOCAL_MESSAGES
+    elif name == "gemini":
+        messages = GEMINI_MESSAGES
+        agent.plan_cache = main.PlanCache(0, 0)
+    elif name == "burst":
+        # Roughly the production mix: most turns local, one in five needs a plan
+        messages = LOCAL_MESSAGES[:4] + GEMINI_MESSAGES[:1]
+        requests = concurrency = args.burst
+    else:
+        messages = [ALL_STATUS_MESSAGE]
+
+    try:
+        result = await drive(agent, messages, requests, concurrency, args.users)
+    finally:
+        await agent.close()
+
+    latencies = sorted(result["latencies"])
+    return {
+        "workload": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": result["errors"],
+        "req_per_s": round(requests / result["elapsed"], 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "device_requests": service.requests,
+        "gemini_requests": gemini.requests,
+        "gemini_429s": gemini.throttled,
+    }
+
+
+async def main_async(args):
+    # Per-request INFO logging would dominate the measurement
+    logging.disable(logging.ERROR)
+    await main.conversation_store.start()
+
+    print(f"device-service {args.device_latency_ms:g} ms, Gemini {args.gemini_latency_ms:g} ms "
+          f"({args.gemini_429_rate:.0%} 429s), {args.users} users\n")
+    print(f"{'workload':<12} {'requests':>8} {'conc':>5} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'device':>7} {'gemini':>7}")
+
+    results = []
+    try:
+        for name in args.workloads:
+            r = await run_workload(name, args)
+            results.append(r)
+            print(f"{r['workload']:<12} {r['requests']:>8} {r['concurrency']:>5} {r['errors']:>6} "
+                  f"{r['req_per_s']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{r['device_requests']:>7} {r['gemini_requests']:>7}")
+    finally:
+        await main.conversation_store.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k != "json"}, "results": results}, f, indent=2)
+        print(f"\nresults written to {args.json}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workloads", nargs="*", default=WORKLOADS, metavar="WORKLOAD",
+                        help=f"any of {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--devices", type=int, default=20, help="home size for the local, gemini and burst workloads")
+    parser.add_argument("--burst", type=int, default=200, help="requests released at once by the burst workload")
+    parser.add_argument("--device-latency-ms", type=float, default=5.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=400.0)
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="fraction of Gemini calls answered 429")
+    parser.add_argument("--gemini-retry-after", type=float, default=None, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--gemini-rate", type=float, default=1000.0, help="Gemini admission tokens per second")
+    parser.add_argument("--gemini-burst", type=int, default=None,
+                        help="Gemini admission bucket size (default: enough for --concurrency or --burst)")
+    parser.add_argument("--json", help="also write results to this file for comparison between runs")
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(sorted(unknown))}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,84 @@
+"""
+Benchmark: get_all_device_statuses against a simulated device-service.
+
+Usage: python benchmarks/bench_device_statuses.py [--latency-ms N] [--rounds N]
+
+device-service is replaced by fakes.FakeDeviceService, which sleeps --latency-ms
+per request and tracks how many requests are in flight. Three strategies run
+for homes of 10, 100 and 1,000 devices:
+
+  legacy    one /devices call plus an unbounded gather of /devices/{id}/status
+  derived   statuses built from the /devices response (config + last_seen)
+  fallback  list entries without last_seen, fetched STATUS_FETCH_CONCURRENCY at a time
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from fakes import FakeDeviceService, install  # noqa: E402
+
+HOME_SIZES = [10, 100, 1000]
+
+
+async def legacy_all_statuses(agent, user_id):
+    """The previous implementation: one status request per device, all at once."""
+    devices = (await agent._tool_list_devices(user_id, {})).get("devices", [])
+
+    async def get_status(device):
+        response = await agent.device_client.get(
+            f"{main.DEVICE_SERVICE_URL}/devices/{device['id']}/status", headers={"X-User-ID": user_id}
+        )
+        return response.json()
+
+    statuses = await asyncio.gather(*[get_status(d) for d in devices])
+    return {"statuses": list(statuses), "count": len(statuses)}
+
+
+async def run(strategy: str, device_count: int, latency: float, rounds: int):
+    service = FakeDeviceService(device_count, latency, with_last_seen=strategy != "fallback")
+    agent = main.AgenticAI()
+    await install(agent, service)
+
+    elapsed = 0.0
+    for _ in range(rounds):
+        agent.device_cache.invalidate("bench-user")  # Measure the cold path every round
+        start = time.perf_counter()
+        if strategy == "legacy":
+            result = await legacy_all_statuses(agent, "bench-user")
+        else:
+            result = await agent._tool_get_all_device_statuses("bench-user", {})
+        elapsed += time.perf_counter() - start
+        assert result["count"] == device_count
+
+    await agent.close()
+    return elapsed / rounds, service.requests / rounds, service.peak_in_flight
+
+
+async def main_async(args):
+    # Per-request INFO logging would dominate the measurement
+    logging.disable(logging.ERROR)
+    print(f"device-service latency {args.latency_ms:.0f} ms, STATUS_FETCH_CONCURRENCY={main.STATUS_FETCH_CONCURRENCY}\n")
+    print(f"{'devices':>8} {'strategy':<10} {'ms/call':>10} {'requests':>9} {'peak in flight':>15}")
+    for device_count in HOME_SIZES:
+        for strategy in ("legacy", "derived", "fallback"):
+            latency, requests, peak = await run(strategy, device_count, args.latency_ms / 1000, args.rounds)
+            print(f"{device_count:>8} {strategy:<10} {latency * 1000:>10.1f} {requests:>9.0f} {peak:>15}")
+        print()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: compiled IntentRouter vs the original substring-scan chain.
+
+Usage: python benchmarks/bench_intent_router.py [--iterations N]
+
+Only classification is measured (no device-service calls). The legacy chain
+below reproduces the checks _try_local_handling used to run on every message.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import intent_router  # noqa: E402
+
+MESSAGES = [
+    "What devices do I have?",
+    "show me the status of all my devices",
+    "what is the status of my devices",
+    "Is the front door locked?",
+    "turn on all the lights please",
+    "Turn off the living room lamp",
+    "lock the back door",
+    "set the thermostat to 72 degrees",
+    "show me this week's activity summary",
+    "Can you create an automation that turns on the porch light at sunset?",
+    "why is my energy bill so high this month compared to last year",
+    "good morning!",
+    "what's the weather like and should I close the windows",
+]
+
+POWER_ACTIONS = [("turn on", "turn_on"), ("turn off", "turn_off"), ("switch on", "turn_on"), ("switch off", "turn_off")]
+
+
+def legacy_classify(message):
+    """The pre-router chain of substring checks, returning the first intent matched."""
+    msg_lower = message.lower().strip()
+    device_patterns = ["what devices", "list devices", "show devices", "my devices", "all devices", "do i have"]
+    if any(p in msg_lower for p in device_patterns) and "status" not in msg_lower:
+        return "list_devices"
+    if any(p in msg_lower for p in ["status of all", "all device status", "all status", "status of my devices", "show me all device"]):
+        return "all_device_status"
+    if any(p in msg_lower for p in ["status of", "what is the status", "is the", "check the", "how is the"]):
+        return "device_status"
+    for action, cmd in POWER_ACTIONS:
+        if action in msg_lower and "all" in msg_lower and "light" in msg_lower:
+            return "all_lights"
+    for action, cmd in POWER_ACTIONS:
+        if action in msg_lower:
+            text = msg_lower.replace(action, "").strip()
+            for word in ["the", "my", "please", "can you", "could you", "device", "for me"]:
+                text = text.replace(word, "").strip()
+            if text:
+                return "device_power"
+    for action, cmd in [("unlock", "unlock"), ("lock", "lock")]:
+        if action in msg_lower and ("door" in msg_lower or "lock" in msg_lower):
+            return "lock"
+    if "temperature" in msg_lower or "thermostat" in msg_lower:
+        temp_match = re.search(r'(\d+)\s*(?:degrees?|°|f)?', msg_lower)
+        if temp_match and ("set" in msg_lower or "to" in msg_lower):
+            return "set_temperature"
+    if any(p in msg_lower for p in ["analytics", "usage", "activity", "summary", "insights"]):
+        period = "day"
+        if "week" in msg_lower:
+            period = "week"
+        elif "month" in msg_lower:
+            period = "month"
+        return "analytics"
+    return None
+
+
+def router_classify(message):
+    intent = next(intent_router.classify(message.lower().strip()), None)
+    return intent.name if intent else None
+
+
+def bench(fn, messages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            fn(message)
+    elapsed = time.perf_counter() - start
+    return iterations * len(messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'message':<72} {'legacy':<18} {'router':<18}")
+    for message in MESSAGES:
+        print(f"{message[:70]:<72} {str(legacy_classify(message)):<18} {str(router_classify(message)):<18}")
+    print()
+
+    workloads = {
+        "local-path messages": [m for m in MESSAGES if legacy_classify(m)],
+        "Gemini-bound messages": [m for m in MESSAGES if not legacy_classify(m)],
+        "all messages": MESSAGES,
+    }
+    print(f"{'workload':<24} {'legacy msgs/s':>14} {'router msgs/s':>14} {'speedup':>8}")
+    for name, messages in workloads.items():
+        legacy = bench(legacy_classify, messages, args.iterations)
+        router = bench(router_classify, messages, args.iterations)
+        print(f"{name:<24} {legacy:>14,.0f} {router:>14,.0f} {router / legacy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+In-process stand-ins for device-service and the Gemini API.
+
+Both plug into httpx.MockTransport, so the agent's real request, retry and
+formatting code runs unchanged with no network and no API key:
+
+    service = FakeDeviceService(100, latency=0.005)
+    gemini = FakeGemini(latency=0.4, rate_limited=0.05)
+    await install(agent, service, gemini)
+
+Every fake counts the requests it served and the peak number in flight.
+"""
+
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+import main
+
+ROOMS = ["Living Room", "Kitchen", "Bedroom", "Office", "Garage", "Hallway", "Porch", "Basement"]
+DEVICE_TYPES = ["light", "thermostat", "smart_lock", "camera", "smart_plug"]
+TYPE_NAMES = {"light": "Light", "thermostat": "Thermostat", "smart_lock": "Lock",
+              "camera": "Camera", "smart_plug": "Plug"}
+DEFAULT_CONFIG = {
+    "light": {"power_on": False, "brightness": 80},
+    "thermostat": {"target_temp": 70, "current_temp": 68, "mode": "heat"},
+    "smart_lock": {"locked": True},
+    "camera": {"power_on": True, "recording": False},
+    "smart_plug": {"power_on": False},
+}
+
+# Config changes device-service applies when it accepts a command (sendCommand in main.go)
+COMMAND_UPDATES = {
+    "turn_on": ("power_on", True),
+    "turn_off": ("power_on", False),
+    "lock": ("locked", True),
+    "unlock": ("locked", False),
+    "arm": ("mode", "armed"),
+    "disarm": ("mode", "disarmed"),
+}
+COMMAND_PAYLOAD_UPDATES = {"set_brightness": ("brightness", "brightness"),
+                           "set_temperature": ("target_temp", "temperature")}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def device_status(device: Dict) -> Dict:
+    """The flat /devices/{id}/status payload, built the way getDeviceStatus in main.go builds it."""
+    last_seen = datetime.fromisoformat(device["last_seen"])
+    status = {
+        "device_id": device["id"],
+        "name": device["name"],
+        "type": device["type"],
+        "online": (datetime.now(timezone.utc) - last_seen).total_seconds() < 120,
+        "status": device["status"],
+        "last_seen": device["last_seen"],
+        "location": device["location"],
+        "config": device["config"],
+    }
+
+    config, device_type = device["config"], device["type"]
+    if device_type in ("light", "smart_plug") and isinstance(config.get("power_on"), bool):
+        status["state"] = "on" if config["power_on"] else "off"
+    if device_type == "light" and _is_number(config.get("brightness")):
+        status["brightness"] = int(config["brightness"])
+    elif device_type == "thermostat":
+        if _is_number(config.get("target_temp")):
+            status["target_temperature"] = int(config["target_temp"])
+        if isinstance(config.get("mode"), str):
+            status["mode"] = config["mode"]
+    elif device_type == "smart_lock" and isinstance(config.get("locked"), bool):
+        status["state"] = "locked" if config["locked"] else "unlocked"
+    elif device_type == "camera":
+        for key in ("recording", "motion_detection"):
+            if isinstance(config.get(key), bool):
+                status[key] = config[key]
+    return status
+
+
+class _Upstream:
+    """Latency and request accounting shared by the fakes."""
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            delay = self.latency + random.uniform(0, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return self.respond(request)
+        finally:
+            self.in_flight -= 1
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        raise NotImplementedError
+
+
+class FakeDeviceService(_Upstream):
+    """device-service emulating /devices, /devices/{id}/status and /devices/{id}/command.
+
+    Every user sees the same generated home. With with_last_seen=False the list
+    omits last_seen, which forces the agent onto its per-device status fallback.
+    """
+
+    def __init__(self, device_count: int, latency: float = 0.005, jitter: float = 0.0,
+                 with_last_seen: bool = True):
+        super().__init__(latency, jitter)
+        self.with_last_seen = with_last_seen
+        self.devices: List[Dict] = []
+        for i in range(device_count):
+            device_type = DEVICE_TYPES[i % len(DEVICE_TYPES)]
+            room = ROOMS[(i // len(DEVICE_TYPES)) % len(ROOMS)]
+            name = f"{room} {TYPE_NAMES[device_type]}"
+            copy = i // (len(DEVICE_TYPES) * len(ROOMS))
+            self.devices.append({
+                "id": f"dev-{i}",
+                "name": f"{name} {copy + 1}" if copy else name,
+                "type": device_type,
+                "location": room,
+                "status": "active",
+                "online": True,
+                "config": dict(DEFAULT_CONFIG[device_type]),
+                "last_seen": _now(),
+            })
+        self.by_id = {d["id"]: d for d in self.devices}
+        self.commands = 0
+        self._heartbeat = time.monotonic()
+
+    def _beat(self):
+        # Keep every device inside the agent's online window on long runs
+        if time.monotonic() - self._heartbeat > main.DEVICE_ONLINE_WINDOW_SECONDS / 4:
+            now = _now()
+            for device in self.devices:
+                device["last_seen"] = now
+            self._heartbeat = time.monotonic()
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        if not request.headers.get("X-User-ID"):
+            return httpx.Response(401, json={"error": "User not authenticated"})
+
+        self._beat()
+        parts = request.url.path.strip("/").split("/")
+        if parts == ["devices"] and request.method == "GET":
+            device_type = request.url.params.get("type")
+            devices = [d for d in self.devices if not device_type or d["type"] == device_type]
+            if not self.with_last_seen:
+                devices = [{k: v for k, v in d.items() if k != "last_seen"} for d in devices]
+            return httpx.Response(200, json={"devices": devices, "count": len(devices)})
+
+        if len(parts) != 3 or parts[0] != "devices" or parts[1] not in self.by_id:
+            return httpx.Response(404, json={"error": "Device not found"})
+        device = self.by_id[parts[1]]
+
+        if parts[2] == "status" and request.method == "GET":
+            return httpx.Response(200, json=device_status(device))
+
+        if parts[2] == "command" and request.method == "POST":
+            body = json.loads(request.content or b"{}")
+            command, payload = body.get("command"), body.get("payload") or {}
+            if not command:
+                return httpx.Response(400, json={"error": "Command is required"})
+            if command in COMMAND_UPDATES:
+                key, value = COMMAND_UPDATES[command]
+                device["config"][key] = value
+            elif command in COMMAND_PAYLOAD_UPDATES:
+                key, field = COMMAND_PAYLOAD_UPDATES[command]
+                if field in payload:
+                    device["config"][key] = payload[field]
+            device["last_seen"] = _now()
+            self.commands += 1
+            return httpx.Response(202, json={
+                "id": f"cmd-{self.commands}", "device_id": device["id"], "user_id": request.headers["X-User-ID"],
+                "command": command, "payload": payload, "status": "pending",
+                "created_at": _now(), "updated_at": _now(),
+            })
+
+        return httpx.Response(405, json={"error": "Method not allowed"})
+
+
+class FakeGemini(_Upstream):
+    """generateContent stub returning a fixed plan of functionCalls.
+
+    A rate_limited fraction of requests get a 429 RESOURCE_EXHAUSTED, with a
+    Retry-After header when retry_after is set, so retry and admission
+    behaviour can be exercised without a quota.
+    """
+
+    def __init__(self, plan: Optional[List[Dict]] = None, latency: float = 0.4, jitter: float = 0.0,
+                 rate_limited: float = 0.0, retry_after: Optional[float] = None):
+        super().__init__(latency, jitter)
+        self.plan = plan if plan is not None else [{"name": "list_devices", "args": {}}]
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.throttled = 0
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith(":generateContent"):
+            return httpx.Response(404, json={"error": {"code": 404, "status": "NOT_FOUND"}})
+
+        if self.rate_limited and random.random() < self.rate_limited:
+            self.throttled += 1
+            headers = {"Retry-After": f"{self.retry_after:g}"} if self.retry_after is not None else {}
+            return httpx.Response(429, headers=headers, json={
+                "error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                          "status": "RESOURCE_EXHAUSTED"}
+            })
+
+        parts = [{"functionCall": {"name": call["name"], "args": call.get("args", {})}} for call in self.plan]
+        return httpx.Response(200, json={
+            "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}]
+        })
+
+
+async def install(agent: "main.AgenticAI", device_service: FakeDeviceService, gemini: Optional[FakeGemini] = None):
+    """Point the agent's upstream clients at the fakes, closing the real clients first."""
+    await agent.device_client.aclose()
+    agent.device_client = httpx.AsyncClient(transport=httpx.MockTransport(device_service.handler))
+    if gemini is not None:
+        await agent.gemini_client.aclose()
+        agent.gemini_client = httpx.AsyncClient(transport=httpx.MockTransport(gemini.handler))
@@ -0,0 +1,305 @@
+"""
+Load generator: replay recorded conversations against a running agentic-ai.
+
+Usage:
+  python benchmarks/loadgen.py record --url URL --user-id USER --conversation-id ID [ID ...] -o transcripts.jsonl
+  python benchmarks/loadgen.py run --url URL --transcripts transcripts.jsonl [--concurrency N | --rate R]
+
+record  fetches GET /agent/history for each conversation and appends it to the
+        output as one JSON line: the /agent/history response plus user_id.
+run     replays the user turns of those transcripts through POST /agent/chat.
+
+A replayed conversation keeps one user id and one conversation id and sends its
+turns in order, each after the previous reply plus --think-time, so history,
+device caches and plan caches see the traffic a real household would produce.
+Conversations recorded for the same user replay under the same synthetic user
+(one of --users) within a round.
+
+  closed loop (default)  --concurrency users, each starting a new conversation as soon as one ends
+  open loop (--rate R)   conversations start as a Poisson process at R per second however slowly
+                         the server answers; arrivals beyond --max-in-flight are counted as dropped
+
+The report covers turn latency percentiles and a histogram, errors by kind, and
+how many turns were answered locally, from the plan cache or by Gemini (the
+X-Agent-Route response header).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import httpx
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def load_transcripts(path: str) -> List[Dict]:
+    """Read recorded conversations, keeping only the user turns to replay."""
+    transcripts = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            turns = [
+                "".join(part.get("text", "") for part in message.get("parts", []))
+                for message in record.get("messages", [])
+                if message.get("role") == "user"
+            ]
+            turns = [turn for turn in turns if turn.strip()]
+            if turns:
+                transcripts.append({"user_id": record.get("user_id", ""), "turns": turns})
+    return transcripts
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.route_latencies: Dict[str, List[float]] = {}
+        self.routes: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.turns = 0
+        self.conversations = 0
+        self.dropped = 0
+
+    def record(self, latency: Optional[float], route: Optional[str], error: Optional[str]):
+        self.turns += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if route:
+            self.routes[route] += 1
+            self.route_latencies.setdefault(route, []).append(latency)
+        if error:
+            self.errors[error] += 1
+
+    def summary(self, elapsed: float) -> Dict:
+        latencies = sorted(self.latencies)
+        buckets = Counter()
+        for latency in latencies:
+            bound = next((b for b in LATENCY_BUCKETS if latency <= b), None)
+            buckets[f"<={bound:g}s" if bound else f">{LATENCY_BUCKETS[-1]:g}s"] += 1
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "conversations": self.conversations,
+            "dropped_conversations": self.dropped,
+            "turns": self.turns,
+            "turns_per_s": round(self.turns / elapsed, 2) if elapsed else 0.0,
+            "errors": sum(self.errors.values()),
+            "error_rate": round(sum(self.errors.values()) / self.turns, 4) if self.turns else 0.0,
+            "errors_by_kind": dict(self.errors),
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                **{f"p{p:g}": round(percentile(latencies, p) * 1000, 1) for p in (50, 90, 95, 99)},
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            },
+            "latency_histogram": {
+                label: buckets[label]
+                for label in [f"<={b:g}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]:g}s"]
+            },
+            "routes": {
+                route: {
+                    "turns": count,
+                    "p50_ms": round(percentile(sorted(self.route_latencies[route]), 50) * 1000, 1),
+                    "p95_ms": round(percentile(sorted(self.route_latencies[route]), 95) * 1000, 1),
+                }
+                for route, count in self.routes.most_common()
+            },
+        }
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, transcripts: List[Dict], args):
+        self.client = client
+        self.transcripts = transcripts
+        self.args = args
+        self.stats = Stats()
+        self._next = 0
+
+    def next_conversation(self) -> tuple[str, List[str]]:
+        """Next transcript in order, with the synthetic user it replays as this round."""
+        index = self._next
+        self._next += 1
+        transcript = self.transcripts[index % len(self.transcripts)]
+        round_number = index // len(self.transcripts)
+        # Same recorded user, same round -> same synthetic user, so their conversations share caches
+        slot = zlib.crc32(f"{transcript['user_id'] or index}:{round_number}".encode()) % self.args.users
+        return f"{self.args.user_prefix}-{slot}", transcript["turns"]
+
+    async def conversation(self, user_id: str, turns: List[str]):
+        self.stats.conversations += 1
+        conversation_id = str(uuid4())
+        for i, message in enumerate(turns):
+            if i and self.args.think_time > 0:
+                await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+            await self.turn(user_id, conversation_id, message)
+
+    async def turn(self, user_id: str, conversation_id: str, message: str):
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(
+                "/agent/chat",
+                json={"message": message, "conversation_id": conversation_id},
+                headers={"X-User-ID": user_id},
+            )
+        except httpx.TimeoutException:
+            self.stats.record(None, None, "timeout")
+            return
+        except httpx.HTTPError as e:
+            self.stats.record(None, None, type(e).__name__)
+            return
+        latency = time.perf_counter() - started
+
+        route = response.headers.get("X-Agent-Route", "unknown")
+        error = None
+        if response.status_code != 200:
+            error = f"http_{response.status_code}"
+        else:
+            try:
+                if response.json().get("error"):
+                    # /agent/chat reports busy and upstream failures in the body with a 200
+                    error = "agent_error"
+            except ValueError:
+                error = "invalid_json"
+        self.stats.record(latency, route, error)
+
+    async def closed_loop(self, deadline: float):
+        async def user():
+            while time.monotonic() < deadline and not self._exhausted():
+                await self.conversation(*self.next_conversation())
+
+        await asyncio.gather(*(user() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, deadline: float):
+        in_flight: set = set()
+        while time.monotonic() < deadline and not self._exhausted():
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            if len(in_flight) >= self.args.max_in_flight:
+                self.stats.dropped += 1
+                self._next += 1
+                continue
+            task = asyncio.create_task(self.conversation(*self.next_conversation()))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    def _exhausted(self) -> bool:
+        return self.args.conversations is not None and self._next >= self.args.conversations
+
+
+def print_report(summary: Dict, mode: str):
+    print(f"\n{mode}: {summary['conversations']} conversations, {summary['turns']} turns "
+          f"in {summary['elapsed_s']}s ({summary['turns_per_s']} turns/s)")
+    if summary["dropped_conversations"]:
+        print(f"dropped at --max-in-flight: {summary['dropped_conversations']} conversations")
+    print(f"errors: {summary['errors']} ({summary['error_rate']:.2%})"
+          + "".join(f"  {kind}={count}" for kind, count in summary["errors_by_kind"].items()))
+
+    lat = summary["latency_ms"]
+    print(f"\nlatency ms  mean {lat['mean']}  p50 {lat['p50']}  p90 {lat['p90']}  "
+          f"p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    total = sum(summary["latency_histogram"].values()) or 1
+    for label, count in summary["latency_histogram"].items():
+        print(f"  {label:>7} {count:>7}  {'#' * round(40 * count / total)}")
+
+    print(f"\n{'route':<12} {'turns':>7} {'share':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for route, r in summary["routes"].items():
+        print(f"{route:<12} {r['turns']:>7} {r['turns'] / summary['turns']:>7.1%} {r['p50_ms']:>8} {r['p95_ms']:>8}")
+
+
+async def run(args):
+    transcripts = load_transcripts(args.transcripts)
+    if not transcripts:
+        sys.exit(f"no user turns found in {args.transcripts}")
+
+    in_flight = args.max_in_flight if args.rate else args.concurrency
+    limits = httpx.Limits(max_connections=in_flight, max_keepalive_connections=in_flight)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        replayer = Replayer(client, transcripts, args)
+        mode = (f"open loop, {args.rate:g} conversations/s" if args.rate
+                else f"closed loop, {args.concurrency} concurrent users")
+        print(f"replaying {len(transcripts)} transcripts against {args.url} ({mode})")
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        if args.rate:
+            await replayer.open_loop(deadline)
+        else:
+            await replayer.closed_loop(deadline)
+        summary = replayer.stats.summary(time.monotonic() - started)
+
+    print_report(summary, mode)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("func", "json")},
+                       "results": summary}, f, indent=2)
+        print(f"\nresults written to {args.json}")
+
+
+async def record(args):
+    written = 0
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        with open(args.output, "a") as out:
+            for conversation_id in args.conversation_id:
+                response = await client.get(
+                    "/agent/history", params={"conversation_id": conversation_id},
+                    headers={"X-User-ID": args.user_id},
+                )
+                response.raise_for_status()
+                history = response.json()
+                if not history.get("messages"):
+                    print(f"skipping {conversation_id}: no history", file=sys.stderr)
+                    continue
+                out.write(json.dumps({"user_id": args.user_id, **history}) + "\n")
+                written += 1
+    print(f"recorded {written} conversation(s) to {args.output}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    rec = subcommands.add_parser("record", help="save conversations from /agent/history as transcripts")
+    rec.add_argument("--url", default="http://localhost:8080")
+    rec.add_argument("--user-id", required=True)
+    rec.add_argument("--conversation-id", nargs="+", required=True)
+    rec.add_argument("-o", "--output", required=True, help="transcript file to append to")
+    rec.add_argument("--timeout", type=float, default=10.0)
+    rec.set_defaults(func=record)
+
+    replay = subcommands.add_parser("run", help="replay transcripts through POST /agent/chat")
+    replay.add_argument("--url", default="http://localhost:8080")
+    replay.add_argument("--transcripts", required=True)
+    replay.add_argument("--concurrency", type=int, default=10, help="closed-loop concurrent users")
+    replay.add_argument("--rate", type=float, default=None, help="open loop: new conversations per second")
+    replay.add_argument("--max-in-flight", type=int, default=500, help="open loop: cap on concurrent conversations")
+    replay.add_argument("--duration", type=float, default=60.0, help="seconds to keep starting conversations")
+    replay.add_argument("--conversations", type=int, default=None, help="stop after starting this many")
+    replay.add_argument("--think-time", type=float, default=0.0, help="mean seconds between a reply and the next turn")
+    replay.add_argument("--users", type=int, default=100, help="synthetic users to spread conversations over")
+    replay.add_argument("--user-prefix", default="loadgen")
+    replay.add_argument("--timeout", type=float, default=60.0)
+    replay.add_argument("--json", help="also write the report to this file")
+    replay.set_defaults(func=run)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main_cli()
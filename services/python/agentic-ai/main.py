@@ -11,20 +11,50 @@ OPTIMIZED: Minimizes Gemini API calls by:
 """
 
 import os
+import re
 import json
+import math
+import hashlib
+import random
+import heapq
+import fcntl
+import functools
+import itertools
+import mmap
+import struct
+import threading
+import zlib
 import logging
 import httpx
+import numpy as np
 import asyncio
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import time
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Awaitable, Callable, Hashable, AsyncIterator, Iterator, NamedTuple
 from uuid import uuid4
 
 from fastapi import FastAPI, HTTPException, Header, BackgroundTasks
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel, model_serializer
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from starlette.responses import Response
 
+try:
+    import h2  # noqa: F401  (installed by httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    from aiokafka import AIOKafkaConsumer
+except ImportError:
+    AIOKafkaConsumer = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,11 +68,146 @@ DEVICE_SERVICE_URL = os.getenv("DEVICE_SERVICE_URL", "http://iot-device-service.
 NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://iot-notification-service.sandbox:8080")
 N8N_WEBHOOK_BASE = os.getenv("N8N_WEBHOOK_BASE", "http://iot-n8n.sandbox:5678/webhook")
 
+# Conversation store limits
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "20"))
+CONVERSATION_MAX_COUNT = int(os.getenv("CONVERSATION_MAX_COUNT", "10000"))
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+CONVERSATION_IDLE_TTL_SECONDS = float(os.getenv("CONVERSATION_IDLE_TTL_SECONDS", "21600"))
+
+# Conversation backend: "memory", or "log" for the file-backed append-only log. One process
+# owns a log directory; run multiple workers with STATE_SOCKET_PATH so only the host opens it.
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")
+CONVERSATION_LOG_DIR = os.getenv("CONVERSATION_LOG_DIR", "/tmp/agentic-ai/conversations")
+CONVERSATION_SEGMENT_BYTES = int(os.getenv("CONVERSATION_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+CONVERSATION_COMPACT_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_COMPACT_INTERVAL_SECONDS", "300"))
+CONVERSATION_COMPACT_GARBAGE_RATIO = float(os.getenv("CONVERSATION_COMPACT_GARBAGE_RATIO", "0.5"))
+
+# Share conversations and the device cache between uvicorn workers through a Unix socket
+STATE_SOCKET_PATH = os.getenv("STATE_SOCKET_PATH", "")
+STATE_CONNECT_TIMEOUT_SECONDS = float(os.getenv("STATE_CONNECT_TIMEOUT_SECONDS", "10"))
+STATE_MAX_MESSAGE_BYTES = int(os.getenv("STATE_MAX_MESSAGE_BYTES", str(16 * 1024 * 1024)))
+# A worker that doesn't take relayed cache events within this long is disconnected (it resets and reconnects)
+STATE_PEER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("STATE_PEER_DRAIN_TIMEOUT_SECONDS", "2"))
+
+# Device catalog cache (sits in front of GET /devices on device-service)
+DEVICE_CACHE_TTL_SECONDS = float(os.getenv("DEVICE_CACHE_TTL_SECONDS", "30"))
+DEVICE_CACHE_MAX_USERS = int(os.getenv("DEVICE_CACHE_MAX_USERS", "1000"))
+
+# Per-device status cache (GET /devices/{id}/status): answers from cache while younger than
+# MAX_STALE, refreshing in the background once older than FRESH
+STATUS_CACHE_FRESH_SECONDS = float(os.getenv("STATUS_CACHE_FRESH_SECONDS", "5"))
+STATUS_CACHE_MAX_STALE_SECONDS = float(os.getenv("STATUS_CACHE_MAX_STALE_SECONDS", "60"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "10000"))
+
+# Live device-state mirror fed from Kafka: "off", "kafka", or "local" (in-process producer for tests)
+DEVICE_STATE_MIRROR = os.getenv("DEVICE_STATE_MIRROR", "off")
+DEVICE_MIRROR_RESEED_SECONDS = float(os.getenv("DEVICE_MIRROR_RESEED_SECONDS", "300"))
+KAFKA_BROKERS = os.getenv("KAFKA_BROKERS", "localhost:9092")
+KAFKA_DEVICE_EVENTS_TOPIC = os.getenv("KAFKA_DEVICE_EVENTS_TOPIC", "device-events")
+KAFKA_HEARTBEATS_TOPIC = os.getenv("KAFKA_HEARTBEATS_TOPIC", "device-heartbeats")
+KAFKA_ALERTS_TOPIC = os.getenv("KAFKA_ALERTS_TOPIC", "device-alerts")
+
+# In-memory event store behind get_analytics, fed from the same device events as the mirror:
+# "off", "kafka" or "local". Defaults to the mirror's feed; with both off, get_analytics only
+# sees commands sent through this worker since it started.
+ANALYTICS_EVENT_FEED = os.getenv("ANALYTICS_EVENT_FEED", DEVICE_STATE_MIRROR)
+ANALYTICS_MAX_USERS = int(os.getenv("ANALYTICS_MAX_USERS", "1000"))
+ANALYTICS_MAX_EVENTS_PER_USER = int(os.getenv("ANALYTICS_MAX_EVENTS_PER_USER", "2000000"))
+ANALYTICS_RETENTION_SECONDS = float(os.getenv("ANALYTICS_RETENTION_SECONDS", str(31 * 86400)))
+
+# Overall time budget for one chat turn; Gemini retries never sleep past it
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "25"))
+
+# Gemini retries: full-jitter exponential backoff, Retry-After wins when present
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "1.0"))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "8.0"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection pools, one per upstream so Gemini and device-service don't compete for sockets
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+GEMINI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+GEMINI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("GEMINI_CONNECT_TIMEOUT_SECONDS", "5"))
+GEMINI_HTTP2 = os.getenv("GEMINI_HTTP2", "true").lower() == "true" and HTTP2_AVAILABLE
+DEVICE_SERVICE_MAX_CONNECTIONS = int(os.getenv("DEVICE_SERVICE_MAX_CONNECTIONS", "100"))
+DEVICE_SERVICE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DEVICE_SERVICE_MAX_KEEPALIVE_CONNECTIONS", "20"))
+DEVICE_SERVICE_CONNECT_TIMEOUT_SECONDS = float(os.getenv("DEVICE_SERVICE_CONNECT_TIMEOUT_SECONDS", "2"))
+DEVICE_SERVICE_TIMEOUT_SECONDS = float(os.getenv("DEVICE_SERVICE_TIMEOUT_SECONDS", "10"))
+
+# device-service circuit breaker: open after this many consecutive failures, probe again after the reset time
+DEVICE_SERVICE_BREAKER_FAILURES = int(os.getenv("DEVICE_SERVICE_BREAKER_FAILURES", "5"))
+DEVICE_SERVICE_BREAKER_RESET_SECONDS = float(os.getenv("DEVICE_SERVICE_BREAKER_RESET_SECONDS", "15"))
+
+# Shared Gemini rate limit: token bucket plus a bounded queue of waiting requests
+GEMINI_RATE_PER_SECOND = float(os.getenv("GEMINI_RATE_PER_SECOND", "1.0"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))
+GEMINI_QUEUE_MAX = int(os.getenv("GEMINI_QUEUE_MAX", "50"))
+
+# Hedging: send a second request once the first outlives this latency percentile (0 disables)
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+# History sent with each planning call: newest entries that fit the token budget, with
+# model replies longer than the per-turn cap reduced to their headline and device names
+GEMINI_HISTORY_TOKEN_BUDGET = int(os.getenv("GEMINI_HISTORY_TOKEN_BUDGET", "400"))
+GEMINI_HISTORY_MAX_ENTRIES = int(os.getenv("GEMINI_HISTORY_MAX_ENTRIES", "6"))
+GEMINI_HISTORY_MODEL_TURN_TOKENS = int(os.getenv("GEMINI_HISTORY_MODEL_TURN_TOKENS", "80"))
+
+# Cache of Gemini tool plans keyed on normalized message + device catalog
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", "600"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "2000"))
+
+# Max planned tool calls executed at once on the Gemini path
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "8"))
+
+# Max device commands in flight at once for bulk actions ("turn off all lights")
+BULK_COMMAND_CONCURRENCY = int(os.getenv("BULK_COMMAND_CONCURRENCY", "10"))
+
+# Max /devices/{id}/status requests in flight for devices the list response can't describe
+STATUS_FETCH_CONCURRENCY = int(os.getenv("STATUS_FETCH_CONCURRENCY", "10"))
+
+# Size of the text chunks sent as "message" events by /agent/stream
+STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", "120"))
+
 # Metrics
 chat_requests = Counter("agentic_ai_chat_requests_total", "Total chat requests", ["status"])
 chat_latency = Histogram("agentic_ai_chat_latency_seconds", "Chat request latency")
+chat_routes = Counter("agentic_ai_chat_route_total", "Answered chat turns by route", ["route"])
+stage_latency = Histogram("agentic_ai_stage_latency_seconds", "Time spent in each chat pipeline stage", ["stage"],
+                          buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+upstream_latency = Histogram("agentic_ai_upstream_latency_seconds", "Upstream HTTP call latency", ["upstream", "tool"],
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
 tool_calls = Counter("agentic_ai_tool_calls_total", "Tool calls made", ["tool_name"])
 gemini_calls = Counter("agentic_ai_gemini_calls_total", "Gemini API calls", ["type"])
+gemini_hedges = Counter("agentic_ai_gemini_hedged_requests_total", "Hedged Gemini requests", ["outcome"])
+gemini_queue_depth = Gauge("agentic_ai_gemini_queue_depth", "Requests waiting for a Gemini rate-limit token")
+gemini_queue_wait = Histogram("agentic_ai_gemini_queue_wait_seconds", "Time spent waiting for a Gemini rate-limit token",
+                              buckets=(0.005, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20))
+gemini_admission = Counter("agentic_ai_gemini_admission_total", "Gemini admission decisions", ["outcome"])
+conversation_count = Gauge("agentic_ai_conversations", "Conversations held in the conversation store")
+conversation_bytes = Gauge("agentic_ai_conversation_bytes", "Approximate size of stored conversation history")
+conversation_evictions = Counter("agentic_ai_conversation_evictions_total", "Conversations evicted from the store", ["reason"])
+gemini_plan_cache = Counter("agentic_ai_gemini_plan_cache_total", "Gemini plan cache lookups", ["result"])
+gemini_history_tokens = Histogram(
+    "agentic_ai_gemini_history_tokens", "Estimated tokens of conversation history per planning call",
+    ["stage"], buckets=(25, 50, 100, 200, 400, 800, 1600, 3200)
+)
+http_pool_wait = Histogram("agentic_ai_http_pool_wait_seconds", "Time a request waited for a pooled connection",
+                           ["upstream"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+http_in_flight = Gauge("agentic_ai_http_requests_in_flight", "Upstream requests awaiting response headers", ["upstream"])
+http_pool_connections = Gauge("agentic_ai_http_pool_connections", "Pooled connections by state", ["upstream", "state"])
+http_pool_max_connections = Gauge("agentic_ai_http_pool_max_connections", "Configured connection pool size", ["upstream"])
+circuit_state = Gauge("agentic_ai_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["upstream"])
+circuit_rejected = Counter("agentic_ai_circuit_rejected_total", "Calls failed fast by an open circuit breaker", ["upstream"])
+state_host = Gauge("agentic_ai_state_host", "1 if this worker hosts the shared state broker")
+status_cache_lookups = Counter("agentic_ai_status_cache_lookups_total", "Device status cache lookups", ["result"])
+device_mirror_live = Gauge("agentic_ai_device_mirror_live", "1 while the device-state mirror is connected to its event feed")
+device_mirror_events = Counter("agentic_ai_device_mirror_events_total", "Events applied to the device-state mirror", ["topic"])
+device_mirror_reads = Counter("agentic_ai_device_mirror_reads_total", "Reads answered from the device-state mirror", ["call"])
+device_cache_lookups = Counter("agentic_ai_device_cache_lookups_total", "Device catalog cache lookups", ["result"])
+device_service_reads = Counter("agentic_ai_device_service_reads_total", "device-service reads by coalescing outcome", ["call", "outcome"])
 
 app = FastAPI(
     title="HomeGuard Agentic AI Service",
@@ -65,6 +230,15 @@ class ChatResponse(BaseModel):
     suggestions: List[str] = []
     timestamp: str
     error: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None  # Per-stage milliseconds, only with X-Debug-Timings
+
+    @model_serializer(mode="wrap")
+    def _omit_unrequested_timings(self, handler):
+        # Keep the wire format of clients that never asked for timings unchanged; error stays null
+        data = handler(self)
+        if self.timings is None:
+            data.pop("timings", None)
+        return data
 
 
 class ActionRequest(BaseModel):
@@ -72,8 +246,772 @@ class ActionRequest(BaseModel):
     parameters: Dict[str, Any] = {}
 
 
-# In-memory conversation storage (would use MongoDB in production)
-conversations: Dict[str, List[Dict]] = {}
+def _message_size(message: Dict) -> int:
+    """Approximate memory held by one history message."""
+    return 64 + sum(len(part.get("text", "")) for part in message.get("parts", []))
+
+
+class _Conversation:
+    __slots__ = ("owner", "messages", "size", "last_used")
+
+    def __init__(self, owner: str, max_messages: int):
+        self.owner = owner
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """Bounded in-memory conversation history with per-user ownership.
+
+    Each conversation is a ring buffer (deque with maxlen), so append and trim
+    are O(1). Conversations are kept in LRU order: idle ones expire after
+    idle_ttl and the least recently used are evicted once the count or byte
+    caps are exceeded.
+
+    This is also the backend interface: subclasses change where messages live
+    by overriding the _encode/_decode/_item_size/_dropped/_removed hooks and
+    the start/close lifecycle.
+    """
+
+    def __init__(self, max_messages: int, max_conversations: int, max_bytes: int, idle_ttl: float):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._bytes = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def append(self, conversation_id: str, user_id: str, message: Dict):
+        """Add a message, creating the conversation for user_id if it's new."""
+        conversation = self._get(conversation_id, user_id)
+        if conversation is None:
+            if conversation_id in self._conversations:
+                raise PermissionError("Conversation belongs to another user")
+            conversation = _Conversation(user_id, self.max_messages)
+            self._conversations[conversation_id] = conversation
+
+        self._push(conversation, self._encode(conversation_id, user_id, message))
+        self._evict()
+
+    async def history(self, conversation_id: str, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Messages of a conversation owned by user_id (newest `limit` if given), else []."""
+        conversation = self._get(conversation_id, user_id)
+        if conversation is None:
+            return []
+        items = list(conversation.messages)
+        if limit is not None and limit < len(items):
+            items = items[-limit:]
+        return [self._decode(item) for item in items]
+
+    async def clear_user(self, user_id: str) -> int:
+        """Remove every conversation owned by user_id."""
+        owned = [cid for cid, c in self._conversations.items() if c.owner == user_id]
+        for conversation_id in owned:
+            self._remove(conversation_id)
+        self._update_metrics()
+        return len(owned)
+
+    # Backend hooks: the in-memory store keeps message dicts as-is
+
+    def _encode(self, conversation_id: str, user_id: str, message: Dict) -> Any:
+        return message
+
+    def _decode(self, item: Any) -> Dict:
+        return item
+
+    def _item_size(self, item: Any) -> int:
+        return _message_size(item)
+
+    def _dropped(self, item: Any):
+        """An item left its ring buffer (trimmed or its conversation was removed)."""
+
+    def _removed(self, conversation_id: str, conversation: _Conversation):
+        """A whole conversation was removed (eviction or clear)."""
+
+    def _push(self, conversation: _Conversation, item: Any):
+        if len(conversation.messages) == conversation.messages.maxlen:
+            oldest = conversation.messages[0]
+            dropped = self._item_size(oldest)
+            conversation.size -= dropped
+            self._bytes -= dropped
+            self._dropped(oldest)
+        size = self._item_size(item)
+        conversation.messages.append(item)
+        conversation.size += size
+        self._bytes += size
+
+    def _get(self, conversation_id: str, user_id: str) -> Optional[_Conversation]:
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None or conversation.owner != user_id:
+            return None
+        conversation.last_used = time.monotonic()
+        self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def _remove(self, conversation_id: str):
+        conversation = self._conversations.pop(conversation_id)
+        self._bytes -= conversation.size
+        for item in conversation.messages:
+            self._dropped(item)
+        self._removed(conversation_id, conversation)
+
+    def _evict(self):
+        # Oldest-used conversations sit at the front, so idle expiry stops at the first live one
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_used < cutoff:
+                reason = "idle"
+            elif len(self._conversations) > self.max_conversations or self._bytes > self.max_bytes:
+                reason = "capacity"
+            else:
+                break
+            self._remove(conversation_id)
+            conversation_evictions.labels(reason=reason).inc()
+        self._update_metrics()
+
+    def _update_metrics(self):
+        conversation_count.set(len(self._conversations))
+        conversation_bytes.set(self._bytes)
+
+
+_RECORD_HEADER = struct.Struct("<II")  # payload length, crc32
+_SEGMENT_NAME_RE = re.compile(r"^(\d{8})(?:-(\d{8}))?\.log$")
+
+
+class LogConversationStore(ConversationStore):
+    """File-backed conversation store: append-only segment log plus in-memory offset index.
+
+    Every message is one length-prefixed, CRC-checked JSON record appended to
+    the active segment; the ring buffers hold (segment, offset, length)
+    references instead of messages, and history reads decode records through
+    memory-mapped segments. Writes are queued to a single writer thread so
+    the event loop never blocks on disk; records not yet flushed are served
+    from a pending map.
+
+    Removing a conversation appends a tombstone. Compaction rewrites all live
+    records of the sealed segments into one segment named after the id range
+    it replaces ("00000001-00000007.log"); on startup that file shadows the
+    plain segments it covers, so a crash mid-compaction never duplicates data.
+
+    A directory has exactly one writer: start() takes an exclusive flock on
+    its LOCK file and refuses to open a log another process holds, since
+    interleaved appends, tail truncation and compaction would corrupt it.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, compact_interval: float, compact_garbage_ratio: float,
+                 max_messages: int, max_conversations: int, max_bytes: int, idle_ttl: float):
+        super().__init__(max_messages, max_conversations, max_bytes, idle_ttl)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compact_interval = compact_interval
+        self.compact_garbage_ratio = compact_garbage_ratio
+
+        self._paths: Dict[int, str] = {}
+        self._segment_total: Dict[int, int] = {}
+        self._segment_live: Dict[int, int] = {}
+        self._active = 0
+        self._active_size = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-log")
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, bytes] = {}
+        self._buffer: List[tuple] = []
+        self._flush_scheduled = False
+        self._files: Dict[int, Any] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._compactor: Optional[asyncio.Task] = None
+        self._replaying = False
+        self._dir_lock = None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._dir_lock = open(os.path.join(self.directory, "LOCK"), "a")
+        try:
+            fcntl.flock(self._dir_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._dir_lock.close()
+            self._dir_lock = None
+            raise RuntimeError(
+                f"Conversation log {self.directory} is in use by another process; give each process its own "
+                f"CONVERSATION_LOG_DIR or set STATE_SOCKET_PATH so one worker hosts the store"
+            )
+        records = await asyncio.get_running_loop().run_in_executor(self._executor, self._recover)
+        now_wall, now = time.time(), time.monotonic()
+        self._replaying = True
+        for segment, offset, length, record in records:
+            conversation_id = record["c"]
+            if record.get("d"):
+                if conversation_id in self._conversations:
+                    self._remove(conversation_id)
+                continue
+            self._segment_live[segment] = self._segment_live.get(segment, 0) + _RECORD_HEADER.size + length
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                conversation = _Conversation(record["u"], self.max_messages)
+                self._conversations[conversation_id] = conversation
+            self._conversations.move_to_end(conversation_id)
+            conversation.last_used = now - max(0.0, now_wall - record.get("t", now_wall))
+            self._push(conversation, (segment, offset, length))
+        self._replaying = False
+        self._evict()
+        logger.info(f"Recovered {len(self._conversations)} conversations from {self.directory}")
+        self._compactor = asyncio.create_task(self._compact_periodically())
+
+    async def close(self):
+        if self._compactor:
+            self._compactor.cancel()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._shutdown)
+        self._executor.shutdown(wait=True)
+        if self._dir_lock:
+            self._dir_lock.close()  # Releases the flock
+            self._dir_lock = None
+
+    # ConversationStore hooks
+
+    def _encode(self, conversation_id: str, user_id: str, message: Dict) -> tuple:
+        return self._write_record({"c": conversation_id, "u": user_id, "t": time.time(), "m": message})
+
+    def _decode(self, item: tuple) -> Dict:
+        return json.loads(self._read_payload(*item))["m"]
+
+    def _item_size(self, item: tuple) -> int:
+        return item[2] + _RECORD_HEADER.size
+
+    def _dropped(self, item: tuple):
+        self._segment_live[item[0]] = self._segment_live.get(item[0], 0) - self._item_size(item)
+
+    def _removed(self, conversation_id: str, conversation: _Conversation):
+        if self._replaying:
+            return
+        self._write_record({"c": conversation_id, "u": conversation.owner, "d": 1}, live=False)
+
+    # Writing (event loop side assigns offsets, the writer thread does the I/O)
+
+    def _write_record(self, record: Dict, live: bool = True) -> tuple:
+        payload = json.dumps(record, separators=(",", ":")).encode()
+        data = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        if self._active_size and self._active_size + len(data) > self.segment_bytes:
+            self._active += 1
+            self._active_size = 0
+        segment = self._active
+        self._paths.setdefault(segment, os.path.join(self.directory, f"{segment:08d}.log"))
+        ref = (segment, self._active_size + _RECORD_HEADER.size, len(payload))
+        self._active_size += len(data)
+        self._segment_total[segment] = self._segment_total.get(segment, 0) + len(data)
+        if live:
+            self._segment_live[segment] = self._segment_live.get(segment, 0) + len(data)
+
+        with self._lock:
+            self._pending[(segment, ref[1])] = payload
+            self._buffer.append((segment, data, (segment, ref[1])))
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            self._executor.submit(self._flush)
+        return ref
+
+    def _flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._flush_scheduled = False
+        for segment, data, _ in batch:
+            handle = self._files.get(segment)
+            if handle is None:
+                # Segment rolled: seal the previous one before opening the next
+                for old in list(self._files):
+                    self._files.pop(old).close()
+                handle = self._files[segment] = open(self._paths[segment], "ab")
+            handle.write(data)
+        for handle in self._files.values():
+            handle.flush()
+        with self._lock:
+            for _, _, key in batch:
+                self._pending.pop(key, None)
+
+    def _shutdown(self):
+        self._flush()
+        for handle in self._files.values():
+            handle.flush()
+            os.fsync(handle.fileno())
+            handle.close()
+        self._files.clear()
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps.clear()
+
+    # Reading
+
+    def _read_payload(self, segment: int, offset: int, length: int) -> bytes:
+        with self._lock:
+            payload = self._pending.get((segment, offset))
+        if payload is not None:
+            return payload
+        segment_map = self._maps.get(segment)
+        if segment_map is None or offset + length > len(segment_map):
+            # First read, or the segment grew since it was mapped
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._paths[segment], "rb") as f:
+                segment_map = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment_map[offset:offset + length]
+
+    def _recover(self) -> List[tuple]:
+        """Scan segments in order (writer thread); returns (segment, offset, length, record) tuples."""
+        plain: Dict[int, str] = {}
+        compacted: List[tuple] = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_NAME_RE.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.directory, name)
+            if match.group(2):
+                compacted.append((int(match.group(1)), int(match.group(2)), path))
+            else:
+                plain[int(match.group(1))] = path
+
+        # A compacted file shadows every segment in its id range, including older compactions
+        for first, last, path in sorted(compacted):
+            for segment in [s for s in plain if first <= s <= last]:
+                os.remove(plain.pop(segment))
+            plain[last] = path
+
+        records = []
+        for segment in sorted(plain):
+            path = plain[segment]
+            with open(path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + _RECORD_HEADER.size <= len(data):
+                length, crc = _RECORD_HEADER.unpack_from(data, offset)
+                start = offset + _RECORD_HEADER.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                record = json.loads(payload)
+                records.append((segment, start, length, record))
+                self._segment_total[segment] = self._segment_total.get(segment, 0) + _RECORD_HEADER.size + length
+                offset = start + length
+            if offset < len(data):
+                logger.warning(f"Truncating torn tail of {path} at offset {offset}")
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+            self._paths[segment] = path
+
+        self._active = max(plain, default=0) + 1
+        return records
+
+    # Compaction
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"Conversation log compaction failed: {e}")
+
+    async def compact(self, force: bool = False):
+        """Rewrite the live records of all sealed segments into one compacted segment."""
+        sealed = sorted(s for s in self._paths if s < self._active)
+        if not sealed:
+            return
+        total = sum(self._segment_total.get(s, 0) for s in sealed)
+        live = sum(self._segment_live.get(s, 0) for s in sealed)
+        if not force and (total == 0 or 1 - live / total < self.compact_garbage_ratio):
+            return
+
+        sealed_set = set(sealed)
+        live_refs = [item for c in self._conversations.values() for item in c.messages if item[0] in sealed_set]
+        first, last = sealed[0], sealed[-1]
+        path = os.path.join(self.directory, f"{first:08d}-{last:08d}.log")
+        loop = asyncio.get_running_loop()
+        moved = await loop.run_in_executor(self._executor, self._write_compacted, live_refs, last, path)
+
+        # Swap references; anything dropped while we were writing simply isn't found
+        for conversation in self._conversations.values():
+            if any(item in moved for item in conversation.messages):
+                conversation.messages = deque((moved.get(item, item) for item in conversation.messages),
+                                              maxlen=self.max_messages)
+        old_paths = [self._paths.pop(s) for s in sealed]
+        for segment in sealed:
+            self._segment_total.pop(segment, None)
+            self._segment_live.pop(segment, None)
+            segment_map = self._maps.pop(segment, None)
+            if segment_map is not None:
+                segment_map.close()
+        self._paths[last] = path
+        self._segment_total[last] = self._segment_live[last] = sum(self._item_size(r) for r in moved.values())
+
+        await loop.run_in_executor(self._executor, self._delete_files, [p for p in old_paths if p != path])
+        logger.info(f"Compacted conversation segments {first}-{last}: {total} -> {self._segment_total[last]} bytes")
+
+    def _write_compacted(self, live_refs: List[tuple], segment: int, path: str) -> Dict[tuple, tuple]:
+        moved = {}
+        offset = 0
+        sources: Dict[int, Any] = {}
+        with open(path + ".tmp", "wb") as out:
+            for ref in live_refs:
+                # Read through private handles; the shared mmaps belong to the event loop
+                source = sources.get(ref[0])
+                if source is None:
+                    source = sources[ref[0]] = open(self._paths[ref[0]], "rb")
+                source.seek(ref[1])
+                payload = source.read(ref[2])
+                out.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                out.write(payload)
+                moved[ref] = (segment, offset + _RECORD_HEADER.size, len(payload))
+                offset += _RECORD_HEADER.size + len(payload)
+            out.flush()
+            os.fsync(out.fileno())
+        for source in sources.values():
+            source.close()
+        os.replace(path + ".tmp", path)
+        return moved
+
+    def _delete_files(self, paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _create_conversation_store() -> ConversationStore:
+    limits = (CONVERSATION_MAX_MESSAGES, CONVERSATION_MAX_COUNT, CONVERSATION_MAX_BYTES, CONVERSATION_IDLE_TTL_SECONDS)
+    if CONVERSATION_BACKEND == "log":
+        return LogConversationStore(
+            CONVERSATION_LOG_DIR, CONVERSATION_SEGMENT_BYTES, CONVERSATION_COMPACT_INTERVAL_SECONDS,
+            CONVERSATION_COMPACT_GARBAGE_RATIO, *limits
+        )
+    return ConversationStore(*limits)
+
+
+# Requests a worker may run against the host's conversation store
+_STATE_OPS = {"append", "history", "clear_user"}
+
+
+class StateBroker:
+    """Host side of shared worker state: owns the conversation store and relays cache events.
+
+    Speaks JSON lines over a Unix socket. {"id", "op", "args"} requests are run
+    against the store in arrival order; {"event", "args"} messages are fanned
+    out to every other connected worker. The fan-out waits for each peer's
+    buffer to drain, so a slow worker can't make the host buffer without
+    bound; one that stays stuck is disconnected.
+    """
+
+    def __init__(self, path: str, store: ConversationStore):
+        self.path = path
+        self.store = store
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: set = set()
+
+    async def start(self):
+        await self.store.start()
+        try:
+            os.unlink(self.path)  # Left behind by a host that died
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path, limit=STATE_MAX_MESSAGE_BYTES)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self.store.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if "event" in message:
+                    await self._fan_out(writer, line)
+                    continue
+                writer.write(json.dumps(await self._handle(message)).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Dropping shared state connection: {e}")
+        except asyncio.CancelledError:
+            pass  # Host shutting down
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _fan_out(self, sender: asyncio.StreamWriter, line: bytes):
+        peers = [other for other in self._writers if other is not sender]
+        for peer in peers:
+            peer.write(line)
+        drained = await asyncio.gather(
+            *(asyncio.wait_for(peer.drain(), STATE_PEER_DRAIN_TIMEOUT_SECONDS) for peer in peers),
+            return_exceptions=True,
+        )
+        for peer, result in zip(peers, drained):
+            if isinstance(result, Exception):
+                logger.warning(f"Disconnecting shared state peer that isn't reading events: {result!r}")
+                self._writers.discard(peer)
+                peer.close()
+
+    async def _handle(self, request: Dict) -> Dict:
+        reply = {"id": request.get("id")}
+        try:
+            if request.get("op") not in _STATE_OPS:
+                raise ValueError(f"Unknown operation: {request.get('op')}")
+            reply["result"] = await getattr(self.store, request["op"])(*request.get("args", []))
+        except PermissionError as e:
+            reply["error"] = {"type": "permission", "message": str(e)}
+        except Exception as e:
+            reply["error"] = {"type": "internal", "message": str(e)}
+        return reply
+
+
+class StateClient:
+    """Worker side of the shared state socket, with host election and failover.
+
+    Workers race for an exclusive flock on "<socket>.lock"; the winner runs the
+    StateBroker in-process and every worker, the host included, talks to it over
+    the socket. The kernel releases the lock when the host dies, so whichever
+    worker notices the broken connection first takes over. With the in-memory
+    backend history does not survive that; CONVERSATION_BACKEND=log does.
+    """
+
+    def __init__(self, path: str, store_factory: Callable[[], ConversationStore]):
+        self.path = path
+        self.store_factory = store_factory
+        self.broker: Optional[StateBroker] = None
+        self._lock_file = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._handlers: Dict[str, Callable] = {}
+        self._reader_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def subscribe(self, event: str, handler: Callable):
+        """Call handler(*args) for events published by other workers ("reset" fires after failover)."""
+        self._handlers[event] = handler
+
+    async def start(self):
+        self._connected = asyncio.Event()
+        await self._connect()
+        self._connected.set()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        self._closing = True
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self.broker:
+            await self.broker.close()
+        if self._lock_file:
+            self._lock_file.close()
+
+    async def call(self, op: str, *args) -> Any:
+        if not self._connected.is_set():
+            await asyncio.wait_for(self._connected.wait(), STATE_CONNECT_TIMEOUT_SECONDS)
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(json.dumps({"id": request_id, "op": op, "args": list(args)}).encode() + b"\n")
+        reply = await future
+        error = reply.get("error")
+        if error:
+            raise (PermissionError if error["type"] == "permission" else RuntimeError)(error["message"])
+        return reply.get("result")
+
+    def publish(self, event: str, *args):
+        """Best-effort broadcast to the other workers; dropped while reconnecting."""
+        if self._connected is not None and self._connected.is_set():
+            self._writer.write(json.dumps({"event": event, "args": list(args)}).encode() + b"\n")
+
+    def _try_lock(self) -> bool:
+        if self._lock_file is None:
+            self._lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    async def _connect(self):
+        deadline = time.monotonic() + STATE_CONNECT_TIMEOUT_SECONDS
+        while True:
+            if self.broker is None and self._try_lock():
+                self.broker = StateBroker(self.path, self.store_factory())
+                await self.broker.start()
+                state_host.set(1)
+                logger.info(f"Hosting shared state on {self.path} (pid {os.getpid()})")
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=STATE_MAX_MESSAGE_BYTES)
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The host is still binding, or died and its successor isn't up yet
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05 + random.random() * 0.1)
+
+    async def _read_loop(self):
+        while not self._closing:
+            try:
+                while line := await self._reader.readline():
+                    message = json.loads(line)
+                    if "event" in message:
+                        handler = self._handlers.get(message["event"])
+                        if handler:
+                            handler(*message["args"])
+                        continue
+                    future = self._pending.pop(message["id"], None)
+                    if future and not future.done():
+                        future.set_result(message)
+            except (ConnectionError, ValueError) as e:
+                logger.warning(f"Shared state connection error: {e}")
+            if self._closing:
+                return
+
+            logger.warning("Lost the shared state host, re-electing")
+            self._connected.clear()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Shared state host went away"))
+            self._pending.clear()
+            # Events published while we were disconnected are lost
+            if "reset" in self._handlers:
+                self._handlers["reset"]()
+            try:
+                await self._connect()
+                self._connected.set()
+            except OSError as e:
+                logger.error(f"Shared state failover failed: {e}")
+                await asyncio.sleep(1)
+
+
+class RemoteConversationStore(ConversationStore):
+    """Conversation store for workers in shared-state mode; the elected host owns the data."""
+
+    def __init__(self, client: StateClient):
+        self.client = client
+
+    async def append(self, conversation_id: str, user_id: str, message: Dict):
+        await self.client.call("append", conversation_id, user_id, message)
+
+    async def history(self, conversation_id: str, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        return await self.client.call("history", conversation_id, user_id, limit)
+
+    async def clear_user(self, user_id: str) -> int:
+        return await self.client.call("clear_user", user_id)
+
+
+# Shared state across uvicorn workers on one pod (STATE_SOCKET_PATH), else per process
+state_client = StateClient(STATE_SOCKET_PATH, _create_conversation_store) if STATE_SOCKET_PATH else None
+
+# Conversation history: in memory by default, or the durable log (CONVERSATION_BACKEND=log)
+conversation_store = RemoteConversationStore(state_client) if state_client else _create_conversation_store()
+
+# Event queue of the /agent/stream request being served (None for plain /agent/chat)
+stream_events: contextvars.ContextVar[Optional[asyncio.Queue]] = contextvars.ContextVar("stream_events", default=None)
+
+
+# Per-request stage timings (seconds) for the debug breakdown; tasks spawned by a turn share the dict
+request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+# How the current turn was answered (local, plan_cache or gemini), reported in X-Agent-Route
+request_route: contextvars.ContextVar[str] = contextvars.ContextVar("request_route", default="none")
+
+# Tool (or local intent) on whose behalf upstream calls are made, for metric labels
+current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("current_tool", default="none")
+
+_active_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("_active_stage", default=None)
+
+
+def _record_timing(name: str, elapsed: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage into stage_latency and the request's breakdown."""
+    if _active_stage.get() == name:
+        yield  # Nested inside the same stage, already being timed
+        return
+    token = _active_stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _active_stage.reset(token)
+        stage_latency.labels(stage=name).observe(elapsed)
+        _record_timing(name, elapsed)
+
+
+@contextmanager
+def _upstream_call(upstream: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        upstream_latency.labels(upstream=upstream, tool=current_tool.get()).observe(elapsed)
+        _record_timing(f"upstream.{upstream}", elapsed)
+
+
+def _timed_stage(name: str) -> Callable:
+    """Decorator form of _stage for synchronous helpers."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms}" for name, ms in timings.items())
+
+
+def _emit(event: str, data: Any):
+    """Publish a progress event to the streaming client, if there is one."""
+    queue = stream_events.get()
+    if queue is not None:
+        queue.put_nowait((event, data))
+
+
+def _sse(event: str, data: Any) -> str:
+    """Encode one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _chunk_text(text: str, size: int) -> List[str]:
+    """Split text into chunks of about `size` chars, breaking on line boundaries where possible."""
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if current and len(current) + len(line) > size:
+            chunks.append(current)
+            current = ""
+        while len(line) > size:
+            chunks.append(line[:size])
+            line = line[size:]
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 # Tool definitions for Gemini function calling
@@ -150,7 +1088,10 @@ TOOLS = [
     },
     {
         "name": "get_analytics",
-        "description": "Get analytics and insights about device usage",
+        "description": "Get analytics and insights about device usage" + (
+            " (limited to commands sent through this assistant since it last restarted)"
+            if DEVICE_STATE_MIRROR == "off" and ANALYTICS_EVENT_FEED == "off" else ""
+        ),
         "parameters": {
             "type": "object",
             "properties": {
@@ -160,49 +1101,1597 @@ TOOLS = [
     }
 ]
 
+PLANNING_SYSTEM_PROMPT = """You are HomeGuard AI. Analyze the user request and return the tool calls needed.
+
+IMPORTANT: Return ALL tool calls needed in a single response. Don't wait for results.
+For device control: Use list_devices first to get IDs, then send_device_command.
+For status of all devices: Use get_all_device_statuses (one call, not multiple get_device_status).
+
+Be concise. Execute actions immediately without asking for confirmation."""
+
+
+def _json_bytes(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class GeminiRequestTemplate:
+    """generateContent request whose static parts are serialized once.
+
+    Tool declarations, generationConfig and the priming exchange are encoded
+    into a byte prefix at construction; render() only encodes the per-request
+    history and splices it in before the closing brackets.
+    """
+
+    def __init__(self, model: str, api_key: str, tools: List[Dict], system_prompt: str,
+                 generation_config: Dict):
+        self.url = f"{GEMINI_BASE_URL}/models/{model}:generateContent?key={api_key}"
+        function_declarations = [
+            {"name": t["name"], "description": t["description"], "parameters": t["parameters"]}
+            for t in tools
+        ]
+        priming = [
+            {"role": "user", "parts": [{"text": system_prompt}]},
+            {"role": "model", "parts": [{"text": "Ready to help."}]}
+        ]
+        self._prefix = (
+            b'{"tools":' + _json_bytes([{"function_declarations": function_declarations}])
+            + b',"generationConfig":' + _json_bytes(generation_config)
+            + b',"contents":' + _json_bytes(priming)[:-1]
+        )
+
+    def render(self, contents: List[Dict]) -> bytes:
+        if not contents:
+            return self._prefix + b"]}"
+        return self._prefix + b"," + _json_bytes(contents)[1:] + b"}"
+
+
+gemini_planning_request = GeminiRequestTemplate(
+    GEMINI_TEXT_MODEL, GEMINI_TEXT_API_KEY, TOOLS, PLANNING_SYSTEM_PROMPT,
+    {
+        "temperature": 0.3,  # Lower for more deterministic tool selection
+        "maxOutputTokens": 512,
+    }
+)
+
+
+# Tools that change device or automation state; every other tool is a read
+WRITE_TOOLS = {"send_device_command", "create_automation"}
+
+
+def _tool_target(name: str, args: Dict) -> Optional[str]:
+    """Device a tool call touches, or None if it spans the whole catalog."""
+    if name in ("get_device_status", "send_device_command"):
+        return args.get("device_id")
+    return None
+
+
+def _plan_dependencies(calls: List[Dict]) -> List[List[int]]:
+    """For each planned tool call, the indexes of earlier calls it must wait for.
+
+    Two calls conflict when at least one is a write and they touch the same
+    device (or either spans the whole catalog). Conflicting calls keep plan
+    order; reads never wait on other reads.
+    """
+    deps = []
+    for i, call in enumerate(calls):
+        is_write = call["name"] in WRITE_TOOLS
+        target = _tool_target(call["name"], call["args"])
+        waits = []
+        for j in range(i):
+            other = calls[j]
+            if not is_write and other["name"] not in WRITE_TOOLS:
+                continue
+            other_target = _tool_target(other["name"], other["args"])
+            if target is None or other_target is None or target == other_target:
+                waits.append(j)
+        deps.append(waits)
+    return deps
+
+
+# Trigger phrases for the local (no-Gemini) path, grouped by the feature they signal
+INTENT_TRIGGERS = {
+    "list": ["what devices", "list devices", "show devices", "my devices", "all devices", "do i have"],
+    "all_status": ["status of all", "all device status", "all status", "status of my devices", "show me all device"],
+    "device_status": ["status of", "what is the status", "is the", "check the", "how is the"],
+    "turn_on": ["turn on", "switch on"],
+    "turn_off": ["turn off", "switch off"],
+    "unlock": ["unlock"],
+    "lock": ["lock"],
+    "temperature": ["temperature", "thermostat"],
+    "analytics": ["analytics", "usage", "activity", "summary", "insights"],
+    "status": ["status"],
+    "all": ["all"],
+    "light": ["light"],
+}
+
+# Words dropped when extracting a device name from "turn on the ..." style commands
+DEVICE_NAME_STOPWORDS = ["turn", "switch", "on", "off", "the", "my", "please", "can", "could", "you", "device", "for", "me"]
+
+# Trigger words that also match their plural form ("all lights", "lock all doors")
+_PLURAL_WORDS = {"device": "s", "light": "s", "door": "s", "lock": "s", "status": "es"}
+
+_DEVICE_NAME_STOPWORD_SET = frozenset(DEVICE_NAME_STOPWORDS)
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+")
+_SET_RE = re.compile(r"\b(?:set|to)\b")
+_PERIOD_RE = re.compile(r"\b(week|month)(?:s|ly)?\b")
+
+
+class Intent(NamedTuple):
+    name: str
+    slots: Dict[str, Any]
+
+
+class IntentRouter:
+    """Classifies a chat message into local-path intents in a single regex pass.
+
+    Every trigger phrase (plus its plural variants) is compiled once into one
+    word-bounded regex shaped as a character trie, so the engine dispatches on
+    each character instead of trying every phrase in turn. The trie sits in a
+    lookahead tried at every word start, so overlapping triggers all match:
+    "what is the status of all" yields both "what is the status" and "status
+    of all". The longest phrase at a start also credits the shorter triggers
+    it contains ("status of all" contains "status of" and "all").
+
+    Features are bits of an int, and the intent plan for each feature
+    combination is worked out once and memoized; per message only the regex
+    scan and the slot extractors the plan actually reaches run.
+    """
+
+    def __init__(self, triggers: Dict[str, List[str]]):
+        variants: Dict[str, str] = {}
+        for feature, phrases in triggers.items():
+            for phrase in phrases:
+                for variant in self._variants(phrase):
+                    variants[variant] = feature
+
+        self._bits = {feature: 1 << i for i, feature in enumerate(triggers)}
+
+        # Features implied by each variant: its own plus any trigger it contains
+        self._implied: Dict[str, int] = {}
+        for variant, feature in variants.items():
+            padded = f" {variant} "
+            mask = self._bits[feature]
+            for other, other_feature in variants.items():
+                if f" {other} " in padded:
+                    mask |= self._bits[other_feature]
+            self._implied[variant] = mask
+
+        self._pattern = re.compile(r"\b(?=(" + self._trie_pattern(list(variants)) + r")\b)")
+        self._plans: Dict[int, tuple] = {}
+
+    @staticmethod
+    def _variants(phrase: str) -> List[str]:
+        variants = [""]
+        for word in phrase.split():
+            forms = [word, word + _PLURAL_WORDS[word]] if word in _PLURAL_WORDS else [word]
+            variants = [f"{v} {form}".strip() for v in variants for form in forms]
+        return variants
+
+    @staticmethod
+    def _trie_pattern(words: List[str]) -> str:
+        trie: Dict[str, Any] = {}
+        for word in words:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        def emit(node: Dict[str, Any]) -> str:
+            branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            if len(branches) == 1 and "" not in node:
+                return branches[0]
+            # Greedy optional group: the longest phrase wins, backtracking to shorter ones
+            return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+        return emit(trie)
+
+    def _mask(self, message: str) -> int:
+        mask = 0
+        for phrase in self._pattern.findall(message):
+            mask |= self._implied[phrase]
+        return mask
+
+    def features(self, message: str) -> set:
+        mask = self._mask(message)
+        return {feature for feature, bit in self._bits.items() if mask & bit}
+
+    def classify(self, message: str) -> Iterator[Intent]:
+        """Matching intents in priority order; slots are extracted only when reached."""
+        mask = self._mask(message)
+        if not mask:
+            return iter(())
+
+        plan = self._plans.get(mask)
+        if plan is None:
+            plan = self._plans[mask] = self._plan({f for f, bit in self._bits.items() if mask & bit})
+        needs_slots, steps = plan
+        if not needs_slots:
+            return iter(steps)
+        return self._extract(steps, message)
+
+    @staticmethod
+    def _extract(steps: tuple, message: str) -> Iterator[Intent]:
+        for step in steps:
+            intent = step if isinstance(step, Intent) else step(message)
+            if intent is not None:
+                yield intent
+
+    @staticmethod
+    def _plan(f: set) -> tuple:
+        """Intents for a feature set, in priority order: fixed Intents, or extractors
+        that build one from the message (None when its slots aren't there).
+
+        Fixed Intents, and their slots, are shared between requests; handlers
+        only read them.
+        """
+        steps: List[Any] = []
+        if "list" in f and "status" not in f:
+            steps.append(Intent("list_devices", {}))
+        if "all_status" in f:
+            steps.append(Intent("all_device_status", {}))
+        if "device_status" in f:
+            steps.append(Intent("device_status", {}))
+
+        command = "turn_on" if "turn_on" in f else "turn_off" if "turn_off" in f else None
+        if command:
+            if "all" in f and "light" in f:
+                steps.append(Intent("all_lights", {"command": command}))
+            steps.append(functools.partial(_device_power_intent, command))
+
+        lock_command = "unlock" if "unlock" in f else "lock" if "lock" in f else None
+        if lock_command:
+            steps.append(Intent("lock", {"command": lock_command, "all": "all" in f}))
+
+        if "temperature" in f:
+            steps.append(_set_temperature_intent)
+
+        if "analytics" in f:
+            steps.append(_analytics_intent)
+
+        return any(not isinstance(step, Intent) for step in steps), tuple(steps)
+
+
+def _device_power_intent(command: str, message: str) -> Optional[Intent]:
+    name = " ".join(word for word in _WORD_RE.findall(message) if word not in _DEVICE_NAME_STOPWORD_SET)
+    return Intent("device_power", {"command": command, "device_name": name}) if name else None
+
+
+def _set_temperature_intent(message: str) -> Optional[Intent]:
+    if not _SET_RE.search(message):
+        return None
+    number = _NUMBER_RE.search(message)
+    return Intent("set_temperature", {"temperature": int(number.group())}) if number else None
+
+
+_ANALYTICS_INTENTS = {period: Intent("analytics", {"period": period}) for period in ("day", "week", "month")}
+
+
+def _analytics_intent(message: str) -> Intent:
+    # Substring checks first: most requests name no period and skip the regex
+    period = _PERIOD_RE.search(message) if "week" in message or "month" in message else None
+    return _ANALYTICS_INTENTS[period.group(1) if period else "day"]
+
+
+intent_router = IntentRouter(INTENT_TRIGGERS)
+
+
+def _config_update_for_command(command: str, payload: Optional[Dict]) -> Dict[str, Any]:
+    """Config fields device-service changes for a command (mirrors its sendCommand handler)."""
+    payload = payload or {}
+    if command == "turn_on":
+        return {"power_on": True}
+    if command == "turn_off":
+        return {"power_on": False}
+    if command == "set_brightness" and "brightness" in payload:
+        return {"brightness": payload["brightness"]}
+    if command == "set_temperature" and "temperature" in payload:
+        return {"target_temp": payload["temperature"]}
+    if command == "lock":
+        return {"locked": True}
+    if command == "unlock":
+        return {"locked": False}
+    if command == "arm":
+        return {"mode": "armed"}
+    if command == "disarm":
+        return {"mode": "disarmed"}
+    return {}
+
+
+# Appended to replies built from cached data while device-service is unreachable
+STALE_DATA_NOTE = "\n_Device service is unreachable right now, so this is the last known state._"
+
+
+def _freshness(age_seconds: float) -> str:
+    if age_seconds < 2:
+        return "Updated just now"
+    if age_seconds < 120:
+        return f"Updated {int(age_seconds)}s ago"
+    return f"Updated {int(age_seconds // 60)} min ago"
+
+
+def _freshness_lines(age_seconds: Optional[float], stale: bool) -> List[str]:
+    """Footer for any reply built from status results: how old they are, and whether device-service was down."""
+    lines = [] if age_seconds is None else [f"_{_freshness(age_seconds)}_"]
+    if stale:
+        lines.append(STALE_DATA_NOTE)
+    return lines
+
+
+# device-service reports a device online if it was seen within this window
+DEVICE_ONLINE_WINDOW_SECONDS = 120
+
+
+def _status_from_device(device: Dict, best_effort: bool = False) -> Optional[Dict]:
+    """Build the /devices/{id}/status payload from a /devices list entry.
+
+    Mirrors device-service's getDeviceStatus. Returns None when the entry lacks
+    the config or last_seen needed to derive it, unless best_effort is set, in
+    which case the list's own online flag stands in.
+    """
+    online = device.get("online")
+    try:
+        last_seen = datetime.fromisoformat(device["last_seen"])
+        if last_seen.tzinfo is None:
+            last_seen = last_seen.replace(tzinfo=timezone.utc)
+        online = (datetime.now(timezone.utc) - last_seen).total_seconds() < DEVICE_ONLINE_WINDOW_SECONDS
+    except (KeyError, TypeError, ValueError):
+        if not best_effort:
+            return None
+    if "config" not in device and not best_effort:
+        return None
+
+    config = device.get("config") or {}
+    status = {
+        "device_id": device.get("id"),
+        "name": device.get("name"),
+        "type": device.get("type"),
+        "online": online,
+        "status": device.get("status"),
+        "last_seen": device.get("last_seen"),
+        "location": device.get("location"),
+        "config": device.get("config"),
+    }
+
+    device_type = device.get("type")
+    if device_type in ("light", "smart_plug") and isinstance(config.get("power_on"), bool):
+        status["state"] = "on" if config["power_on"] else "off"
+    if device_type == "light" and isinstance(config.get("brightness"), (int, float)):
+        status["brightness"] = int(config["brightness"])
+    elif device_type == "thermostat":
+        if isinstance(config.get("target_temp"), (int, float)):
+            status["target_temperature"] = int(config["target_temp"])
+        if isinstance(config.get("mode"), str):
+            status["mode"] = config["mode"]
+    elif device_type == "smart_lock" and isinstance(config.get("locked"), bool):
+        status["state"] = "locked" if config["locked"] else "unlocked"
+    elif device_type == "camera":
+        for key in ("recording", "motion_detection"):
+            if isinstance(config.get(key), bool):
+                status[key] = config[key]
+    elif device_type == "alarm" and isinstance(config.get("mode"), str):
+        status["alarm_mode"] = config["mode"]
+    return status
+
+
+# Request words that never identify a particular device
+MENTION_STOPWORDS = set(DEVICE_NAME_STOPWORDS) | {"is", "are", "of", "what", "how", "check", "status", "set", "all", "and"}
+
+# Words that name a kind of device rather than a particular one; on their own they can
+# only pick out a device when exactly one matches. Device types in the catalog are added.
+DEVICE_TYPE_WORDS = {"light", "lamp", "bulb", "thermostat", "lock", "camera", "cam", "plug", "outlet",
+                     "sensor", "alarm", "speaker", "fan", "heater"}
+
+# Minimum Dice similarity of character trigrams for a misspelled word to count as a match
+FUZZY_NAME_THRESHOLD = 0.5
+
+_NAME_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _singular(token: str) -> str:
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def _name_tokens(text: str) -> List[str]:
+    """Lower-case word tokens with a trailing plural 's' dropped."""
+    return [_singular(t) for t in _NAME_TOKEN_RE.findall(text.lower())]
+
+
+def _trigrams(token: str) -> set:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class DeviceNameIndex:
+    """Inverted index over a user's device names for resolving free-text mentions.
+
+    Name tokens map to the devices containing them, weighted by IDF so a rare
+    word ("kitchen") outweighs a common one ("light"). Words that miss the
+    vocabulary are matched by character trigrams to tolerate typos. Only devices
+    in the postings of the mentioned words are ever scored.
+
+    A mention made only of device-type words ("the light") or in the plural
+    ("the kitchen lights") names a group; resolve() refuses to pick one device
+    out of such a group, or out of a tie, and group() returns its members.
+    """
+
+    def __init__(self, devices: List[Dict]):
+        self.devices = devices
+        self._postings: Dict[str, set] = {}
+        self._name_lengths: List[int] = []
+        self._type_words = set(DEVICE_TYPE_WORDS)
+        for i, device in enumerate(devices):
+            tokens = set(_name_tokens(device.get("name", "")))
+            self._name_lengths.append(len(tokens) or 1)
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(i)
+            self._type_words.update(_name_tokens((device.get("type") or "").replace("_", " ")))
+
+        self._idf = {t: math.log(1 + len(devices) / len(ids)) for t, ids in self._postings.items()}
+        self._trigram_vocab: Dict[str, set] = {}
+        self._trigram_counts: Dict[str, int] = {}
+        for token in self._postings:
+            grams = _trigrams(token)
+            self._trigram_counts[token] = len(grams)
+            for gram in grams:
+                self._trigram_vocab.setdefault(gram, set()).add(token)
+
+    def resolve(self, mention: str) -> Optional[Dict]:
+        """The one device a mention names, or None if no name word matches or it could mean several."""
+        scores, matched, generic, plural = self._match(mention)
+        if not scores:
+            return None
+        if (generic or plural) and len(self._covering(scores, matched)) > 1:
+            return None
+
+        # Prefer names the mention covers fully; equal scores mean the mention can't tell them apart
+        ranked = sorted(scores, key=lambda i: scores[i] + 0.1 * len(matched[i]) / self._name_lengths[i], reverse=True)
+        if len(ranked) > 1:
+            top = scores[ranked[0]] + 0.1 * len(matched[ranked[0]]) / self._name_lengths[ranked[0]]
+            runner_up = scores[ranked[1]] + 0.1 * len(matched[ranked[1]]) / self._name_lengths[ranked[1]]
+            if math.isclose(top, runner_up):
+                return None
+        return self.devices[ranked[0]]
+
+    def group(self, mention: str) -> List[Dict]:
+        """Devices a plural mention ("the lights", "kitchen lights") refers to, in catalog order.
+
+        Every matching word of the mention must match the device. Empty unless
+        the mention is plural.
+        """
+        scores, matched, _, plural = self._match(mention)
+        if not plural:
+            return []
+        return [self.devices[i] for i in sorted(self._covering(scores, matched))]
+
+    def _match(self, mention: str) -> tuple:
+        """Per-device scores and matched mention words, plus whether the mention is generic or plural."""
+        scores: Dict[int, float] = {}
+        matched: Dict[int, set] = {}
+        matched_words = set()
+        plural = False
+        for raw in set(_NAME_TOKEN_RE.findall(mention.lower())):
+            token = _singular(raw)
+            if (len(token) <= 2 and not token.isdigit()) or token in MENTION_STOPWORDS or raw in MENTION_STOPWORDS:
+                continue
+            hits = [(token, 1.0)] if token in self._postings else self._fuzzy(token)
+            if not hits:
+                continue
+            matched_words.add(token)
+            plural = plural or raw != token
+            for vocab_token, similarity in hits:
+                weight = self._idf[vocab_token] * similarity
+                for i in self._postings[vocab_token]:
+                    scores[i] = scores.get(i, 0.0) + weight
+                    matched.setdefault(i, set()).add(token)
+
+        generic = bool(matched_words) and matched_words <= self._type_words
+        return scores, matched, generic, plural
+
+    @staticmethod
+    def _covering(scores: Dict[int, float], matched: Dict[int, set]) -> set:
+        """Devices matched by every mention word that matched any device."""
+        words = set().union(*matched.values()) if matched else set()
+        return {i for i in scores if matched[i] == words}
+
+    def _fuzzy(self, token: str) -> List[tuple]:
+        grams = _trigrams(token)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigram_vocab.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        hits = []
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(grams) + self._trigram_counts[candidate])
+            if similarity >= FUZZY_NAME_THRESHOLD:
+                hits.append((candidate, similarity))
+        return hits
+
+
+class DeviceCatalogCache:
+    """Per-user LRU cache of device-service /devices responses with TTL expiry.
+
+    Each user entry holds one list per device_type filter ("" is the full catalog).
+    A generation counter per user lets writes invalidate fetches that were already
+    in flight, so a slow GET /devices can't overwrite a newer command result.
+    """
+
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, tuple]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    def get(self, user_id: str, device_type: str = "") -> Optional[Dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            device_cache_lookups.labels(result="miss").inc()
+            return None
+
+        now = time.monotonic()
+        self._entries.move_to_end(user_id)
+
+        cached = entry.get(device_type)
+        if cached and cached[0] > now:
+            device_cache_lookups.labels(result="hit").inc()
+            return cached[1]
+
+        # A fresh full catalog can answer any type-filtered lookup
+        full = entry.get("")
+        if device_type and full and full[0] > now:
+            devices = [d for d in full[1].get("devices") or [] if d.get("type") == device_type]
+            device_cache_lookups.labels(result="hit").inc()
+            return {"devices": devices, "count": len(devices)}
+
+        device_cache_lookups.labels(result="miss").inc()
+        return None
+
+    def get_stale(self, user_id: str, device_type: str = "") -> Optional[Dict]:
+        """Like get() but ignoring expiry, for answering while device-service is down."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if device_type in entry:
+            return entry[device_type][1]
+        if device_type and "" in entry:
+            devices = [d for d in entry[""][1].get("devices") or [] if d.get("type") == device_type]
+            return {"devices": devices, "count": len(devices)}
+        return None
+
+    def age(self, user_id: str, device_type: str = "") -> Optional[float]:
+        """Seconds since the catalog get_stale() would return was fetched."""
+        entry = self._entries.get(user_id) or {}
+        cached = entry.get(device_type) or (entry.get("") if device_type else None)
+        if cached is None:
+            return None
+        return max(0.0, time.monotonic() - (cached[0] - self.ttl))
+
+    def name_index(self, user_id: str, device_type: str, data: Dict) -> "DeviceNameIndex":
+        """Name index for a catalog returned by get(); built at fetch time when it was cached."""
+        cached = self._entries.get(user_id, {}).get(device_type)
+        if cached and cached[1] is data:
+            return cached[2]
+        return DeviceNameIndex(data.get("devices") or [])
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def put(self, user_id: str, device_type: str, data: Dict, generation: int):
+        if self._generations.get(user_id, 0) != generation:
+            return  # Invalidated while the fetch was in flight
+
+        entry = self._entries.setdefault(user_id, {})
+        entry[device_type] = (time.monotonic() + self.ttl, data, DeviceNameIndex(data.get("devices") or []))
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_users:
+            evicted, _ = self._entries.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+        self._bump_generation(user_id)
+
+    def apply_command(self, user_id: str, device_id: str, command: str, payload: Optional[Dict]):
+        """Patch cached device config after a successful command instead of refetching."""
+        self._bump_generation(user_id)
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+
+        update = _config_update_for_command(command, payload)
+        if not update:
+            # Unknown effect on device state - drop the user's catalog
+            self._entries.pop(user_id, None)
+            return
+
+        for _, data, _ in entry.values():
+            for device in data.get("devices") or []:
+                if device.get("id") == device_id:
+                    device["config"] = {**(device.get("config") or {}), **update}
+
+    def _bump_generation(self, user_id: str):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        if len(self._generations) > 2 * self.max_users:
+            # Keep counters only for users that still have cached data
+            self._generations = {u: g for u, g in self._generations.items() if u in self._entries}
+
+
+class SharedDeviceCatalogCache(DeviceCatalogCache):
+    """Per-worker near-cache kept coherent with the other workers through StateClient events.
+
+    Reads stay local; puts, invalidations and command patches are applied locally
+    and then broadcast so the other workers apply the same change.
+
+    Generation counters are per worker, so a broadcast put carries the time its
+    fetch started instead (time.monotonic is host-wide, and workers share a
+    host). A worker drops a remote put whose fetch started before its own last
+    write for that user, so another worker's older catalog can't overwrite a
+    command patch applied here meanwhile.
+    """
+
+    def __init__(self, max_users: int, ttl: float, client: StateClient):
+        super().__init__(max_users, ttl)
+        self.client = client
+        self._written: "OrderedDict[str, float]" = OrderedDict()  # user -> last local or remote write
+        self._written_floor = 0.0  # Latest write time forgotten by _written, or the last reset
+        client.subscribe("device_cache", self._apply_remote)
+        client.subscribe("reset", self.clear)
+
+    def generation(self, user_id: str) -> tuple[int, float]:
+        return super().generation(user_id), time.monotonic()
+
+    def put(self, user_id: str, device_type: str, data: Dict, generation: tuple[int, float]):
+        local_generation, started = generation
+        if self._generations.get(user_id, 0) != local_generation:
+            return
+        super().put(user_id, device_type, data, local_generation)
+        self.client.publish("device_cache", "put", user_id, device_type, data, started)
+
+    def invalidate(self, user_id: str):
+        super().invalidate(user_id)
+        self.client.publish("device_cache", "invalidate", user_id)
+
+    def apply_command(self, user_id: str, device_id: str, command: str, payload: Optional[Dict]):
+        super().apply_command(user_id, device_id, command, payload)
+        self.client.publish("device_cache", "apply_command", user_id, device_id, command, payload)
+
+    def clear(self):
+        # Bump every generation so fetches already in flight, here or elsewhere, don't repopulate stale data
+        self._entries.clear()
+        self._generations = {user_id: generation + 1 for user_id, generation in self._generations.items()}
+        self._written.clear()
+        self._written_floor = time.monotonic()
+
+    def _bump_generation(self, user_id: str):
+        super()._bump_generation(user_id)
+        self._written[user_id] = time.monotonic()
+        self._written.move_to_end(user_id)
+        while len(self._written) > 2 * self.max_users:
+            _, written = self._written.popitem(last=False)
+            self._written_floor = max(self._written_floor, written)
+
+    def _apply_remote(self, op: str, user_id: str, *args):
+        if op == "put":
+            device_type, data, started = args
+            if started < max(self._written.get(user_id, 0.0), self._written_floor):
+                return  # Fetched before a write this worker has already applied
+            super().put(user_id, device_type, data, super().generation(user_id))
+        elif op == "invalidate":
+            super().invalidate(user_id)
+        elif op == "apply_command":
+            super().apply_command(user_id, *args)
+
+
+class DeviceStatusCache:
+    """LRU cache of /devices/{id}/status payloads for stale-while-revalidate reads.
+
+    get() returns entries of any age up to max_stale along with their age; the
+    caller decides whether to refresh. Like DeviceCatalogCache, a per-device
+    generation keeps a fetch that started before a command from overwriting the
+    command's optimistic update.
+    """
+
+    def __init__(self, max_entries: int, max_stale: float):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (user, device) -> (fetched_at, status)
+        self._generations: Dict[tuple, int] = {}
+
+    def get(self, user_id: str, device_id: str, max_age: Optional[float] = None) -> Optional[tuple[Dict, float]]:
+        """(status, age in seconds) if cached within max_age (default max_stale)."""
+        key = (user_id, device_id)
+        entry = self._entries.get(key)
+        age = time.monotonic() - entry[0] if entry else None
+        if entry is None or age > (self.max_stale if max_age is None else max_age):
+            status_cache_lookups.labels(result="miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        status_cache_lookups.labels(result="fresh" if age <= STATUS_CACHE_FRESH_SECONDS else "stale").inc()
+        return entry[1], age
+
+    def generation(self, user_id: str, device_id: str) -> int:
+        return self._generations.get((user_id, device_id), 0)
+
+    def put(self, user_id: str, device_id: str, status: Dict, generation: int):
+        key = (user_id, device_id)
+        if self._generations.get(key, 0) != generation:
+            return  # A command landed while the fetch was in flight
+        self._entries[key] = (time.monotonic(), status)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def apply_command(self, user_id: str, device_id: str, command: str, payload: Optional[Dict]):
+        """Optimistically apply a successful command's config change to the cached status."""
+        key = (user_id, device_id)
+        self._generations[key] = self._generations.get(key, 0) + 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        update = _config_update_for_command(command, payload)
+        if not update:
+            del self._entries[key]
+            return
+        status = entry[1]
+        device = {**status, "id": status.get("device_id"), "config": {**(status.get("config") or {}), **update}}
+        self._entries[key] = (time.monotonic(), _status_from_device(device, best_effort=True))
+
+    def invalidate(self, user_id: str, device_id: str):
+        key = (user_id, device_id)
+        self._entries.pop(key, None)
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+
+class DeviceStateMirror:
+    """Per-user device state kept current from device-events and device-heartbeats.
+
+    Events only carry changes, so a user is served from the mirror once a full
+    /devices fetch has seeded it, and only until the seed is reseed_after old
+    (devices added or removed never show up as events). Everything is dropped
+    whenever the event feed goes down, since events may have been missed.
+
+    Config edits made through device-service's PUT/PATCH publish no event, so
+    a device's state is only as fresh as its seed or its last event; statuses
+    report that age rather than claiming to be current.
+    """
+
+    def __init__(self, max_users: int, reseed_after: float):
+        self.max_users = max_users
+        self.reseed_after = reseed_after
+        self.live = False
+        # user -> (seeded_at, {device_id: device}, {device_id: monotonic time of its seed or last event})
+        self._users: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def seed(self, user_id: str, devices: List[Dict]):
+        if not self.live:
+            return
+        now = time.monotonic()
+        mirrored = {d["id"]: {**d, "config": dict(d.get("config") or {})} for d in devices if d.get("id")}
+        self._users[user_id] = (now, mirrored, dict.fromkeys(mirrored, now))
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def set_live(self, live: bool):
+        if not live:
+            self._users.clear()
+        self.live = live
+        device_mirror_live.set(1 if live else 0)
+
+    def catalog(self, user_id: str, device_type: str = "") -> Optional[Dict]:
+        devices = self._devices(user_id)
+        if devices is None:
+            return None
+        listed = [{**d, "config": dict(d["config"])} for d in devices.values()
+                  if not device_type or d.get("type") == device_type]
+        return {"devices": listed, "count": len(listed)}
+
+    def statuses(self, user_id: str) -> Optional[List[Dict]]:
+        devices = self._devices(user_id)
+        if devices is None:
+            return None
+        return [self._status(user_id, device) for device in devices.values()]
+
+    def status(self, user_id: str, device_id: str) -> Optional[Dict]:
+        device = (self._devices(user_id) or {}).get(device_id)
+        return self._status(user_id, device) if device else None
+
+    def _status(self, user_id: str, device: Dict) -> Dict:
+        updated = self._users[user_id][2][device["id"]]
+        return {**_status_from_device(device, best_effort=True),
+                "age_seconds": round(time.monotonic() - updated, 1)}
+
+    def apply_command(self, user_id: str, device_id: str, command: str, payload: Optional[Dict]):
+        entry = self._users.get(user_id)
+        device = entry[1].get(device_id) if entry else None
+        if device is None:
+            return
+        update = _config_update_for_command(command, payload)
+        if not update:
+            # Unknown effect: stop answering for this user until the next seed
+            del self._users[user_id]
+            return
+        device["config"].update(update)
+
+    def apply_event(self, topic: str, event: Dict):
+        """Apply one device-service command event or device-ingest event/heartbeat."""
+        entry = self._users.get(event.get("user_id"))
+        device = entry[1].get(event.get("device_id")) if entry else None
+        if device is None:
+            return
+
+        device_mirror_events.labels(topic=topic).inc()
+        entry[2][event["device_id"]] = time.monotonic()
+        if event.get("type") == "device_command":
+            # Command events carry the device as it was before the command
+            self.apply_command(event["user_id"], event["device_id"], event.get("command"), event.get("payload"))
+        if event.get("timestamp"):
+            device["last_seen"] = event["timestamp"]
+            device["online"] = True
+
+    def _devices(self, user_id: str) -> Optional[Dict[str, Dict]]:
+        entry = self._users.get(user_id)
+        if not self.live or entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.reseed_after:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return entry[1]
+
+
+# Event kinds in the analytics store
+EVENT_KIND_EVENT, EVENT_KIND_COMMAND, EVENT_KIND_ALERT = 0, 1, 2
+
+ANALYTICS_PERIOD_SECONDS = {"day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+
+
+def _event_epoch(timestamp: Any) -> float:
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class _EventColumns:
+    """One user's events as parallel NumPy columns, sorted by timestamp before reads."""
+
+    __slots__ = ("ts", "device", "kind", "size", "sorted", "oldest", "device_ids", "device_index")
+
+    def __init__(self, capacity: int = 1024):
+        self.ts = np.empty(capacity, np.float64)
+        self.device = np.empty(capacity, np.int32)
+        self.kind = np.empty(capacity, np.int8)
+        self.size = 0
+        self.sorted = True
+        self.oldest = math.inf
+        self.device_ids: List[str] = []
+        self.device_index: Dict[str, int] = {}
+
+    def append(self, ts: float, device_id: str, kind: int):
+        if self.size == len(self.ts):
+            self._resize(2 * len(self.ts))
+        index = self.device_index.get(device_id)
+        if index is None:
+            index = self.device_index[device_id] = len(self.device_ids)
+            self.device_ids.append(device_id)
+        if self.size and ts < self.ts[self.size - 1]:
+            self.sorted = False
+        if ts < self.oldest:
+            self.oldest = ts
+
+        self.ts[self.size] = ts
+        self.device[self.size] = index
+        self.kind[self.size] = kind
+        self.size += 1
+
+    def ensure_sorted(self):
+        # Events arrive nearly in order; sort only when one didn't
+        if not self.sorted:
+            order = np.argsort(self.ts[:self.size], kind="stable")
+            for column in (self.ts, self.device, self.kind):
+                column[:self.size] = column[:self.size][order]
+            self.sorted = True
+
+    def drop_first(self, count: int):
+        """Drop the count oldest events; the columns must be sorted."""
+        remaining = self.size - count
+        for column in (self.ts, self.device, self.kind):
+            column[:remaining] = column[count:self.size]
+        self.size = remaining
+        self.oldest = float(self.ts[0]) if remaining else math.inf
+
+    def _resize(self, capacity: int):
+        for name in ("ts", "device", "kind"):
+            old = getattr(self, name)
+            new = np.empty(capacity, old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+class DeviceAnalyticsStore:
+    """In-memory columnar store of device events behind get_analytics.
+
+    Per user, events live in NumPy columns (timestamp, device index, kind).
+    A period query is a searchsorted for the window start followed by
+    vectorized aggregates over the tail: bincount per device, argpartition for
+    the top N. Queries never look past the retention window; expired events
+    are dropped on the user's next write, in batches of an eighth of the
+    window so a steady stream doesn't shift the columns on every append.
+    Events beyond the per-user cap are dropped oldest first. Writes never
+    sort: an out-of-order event only marks the columns, and the next query or
+    trim sorts them once.
+    """
+
+    def __init__(self, max_users: int, max_events_per_user: int, retention: float):
+        self.max_users = max_users
+        self.max_events_per_user = max_events_per_user
+        self.retention = retention
+        self._users: "OrderedDict[str, _EventColumns]" = OrderedDict()
+
+    def record(self, user_id: str, device_id: str, kind: int, ts: Optional[float] = None):
+        columns = self._users.get(user_id)
+        if columns is None:
+            columns = self._users[user_id] = _EventColumns()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+
+        now = time.time()
+        if columns.oldest < now - self.retention * 9 / 8 or columns.size >= self.max_events_per_user:
+            self._trim(columns, now)
+        columns.append(now if ts is None else ts, device_id, kind)
+
+    def record_event(self, topic: str, event: Dict):
+        """Ingest a device-service command event or a device-ingest event/alert."""
+        if topic == KAFKA_HEARTBEATS_TOPIC or not event.get("user_id") or not event.get("device_id"):
+            return
+        event_type = event.get("type") or event.get("event_type") or ""
+        if event_type == "device_command":
+            kind = EVENT_KIND_COMMAND
+        elif topic == KAFKA_ALERTS_TOPIC or "alert" in event_type:
+            kind = EVENT_KIND_ALERT
+        else:
+            kind = EVENT_KIND_EVENT
+        self.record(event["user_id"], event["device_id"], kind, _event_epoch(event.get("timestamp")))
+
+    def summary(self, user_id: str, period: str, top_n: int = 3) -> Dict[str, Any]:
+        """Totals over the last day/week/month; top_devices is [(device_id, events)] busiest first."""
+        columns = self._users.get(user_id)
+        if columns is None or columns.size == 0:
+            return {"total_events": 0, "active_devices": 0, "alerts": 0, "top_devices": []}
+
+        columns.ensure_sorted()
+        window = min(ANALYTICS_PERIOD_SECONDS[period], self.retention)
+        start = int(np.searchsorted(columns.ts[:columns.size], time.time() - window))
+        device = columns.device[start:columns.size]
+        kind = columns.kind[start:columns.size]
+
+        counts = np.bincount(device, minlength=len(columns.device_ids))
+        active = int(np.count_nonzero(counts))
+        top = []
+        if active:
+            n = min(top_n, active)
+            busiest = np.argpartition(counts, -n)[-n:]
+            busiest = busiest[np.argsort(-counts[busiest], kind="stable")]
+            top = [(columns.device_ids[i], int(counts[i])) for i in busiest]
+
+        return {
+            "total_events": int(device.size),
+            "active_devices": active,
+            "alerts": int(np.count_nonzero(kind == EVENT_KIND_ALERT)),
+            "top_devices": top,
+        }
+
+    def _trim(self, columns: _EventColumns, now: float):
+        columns.ensure_sorted()
+        expired = int(np.searchsorted(columns.ts[:columns.size], now - self.retention))
+        if columns.size - expired >= self.max_events_per_user:
+            # Still full: keep the newest three quarters so trimming isn't needed on every append
+            expired = columns.size - self.max_events_per_user * 3 // 4
+        columns.drop_first(expired)
+
+
+class LocalDeviceEventProducer:
+    """In-process stand-in for the Kafka producers, for DEVICE_STATE_MIRROR=local.
+
+    Emits the same payloads device-service and device-ingest publish, onto a
+    queue that DeviceEventConsumer reads instead of Kafka.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def send(self, topic: str, event: Dict):
+        self.queue.put_nowait((topic, event))
+
+    def device_command(self, user_id: str, device_id: str, command: str, payload: Optional[Dict] = None):
+        self.send(KAFKA_DEVICE_EVENTS_TOPIC, {
+            "id": str(uuid4()), "type": "device_command", "device_id": device_id, "user_id": user_id,
+            "command": command, "payload": payload or {}, "timestamp": datetime.now(timezone.utc).isoformat(),
+        })
+
+    def heartbeat(self, user_id: str, device_id: str, payload: Optional[Dict] = None):
+        self.send(KAFKA_HEARTBEATS_TOPIC, {
+            "id": str(uuid4()), "device_id": device_id, "user_id": user_id, "event_type": "heartbeat",
+            "timestamp": datetime.now(timezone.utc).isoformat(), "payload": payload or {},
+        })
+
+    def device_event(self, user_id: str, device_id: str, event_type: str, payload: Optional[Dict] = None,
+                     topic: str = KAFKA_DEVICE_EVENTS_TOPIC):
+        self.send(topic, {
+            "id": str(uuid4()), "device_id": device_id, "user_id": user_id, "event_type": event_type,
+            "timestamp": datetime.now(timezone.utc).isoformat(), "payload": payload or {},
+        })
+
+
+class DeviceEventConsumer:
+    """Background task feeding the state mirror and analytics store from Kafka or a LocalDeviceEventProducer.
+
+    Every replica needs every event, so the Kafka consumer joins no group and
+    starts from the latest offset; the mirror is only trusted while connected.
+    With mirror=None (DEVICE_STATE_MIRROR=off) only analytics is fed.
+    """
+
+    def __init__(self, mirror: Optional[DeviceStateMirror], analytics: DeviceAnalyticsStore, mode: str):
+        self.mirror = mirror
+        self.analytics = analytics
+        self.mode = mode
+        self.producer = LocalDeviceEventProducer() if mode == "local" else None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.mode == "kafka" and AIOKafkaConsumer is None:
+            logger.warning("Device event feed is kafka but aiokafka is not installed; feed disabled")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        events = self._local_events if self.producer else self._kafka_events
+        while True:
+            try:
+                async for topic, event in events():
+                    if self.mirror:
+                        self.mirror.apply_event(topic, event)
+                    self.analytics.record_event(topic, event)
+            except asyncio.CancelledError:
+                self._set_live(False)
+                raise
+            except Exception as e:
+                logger.error(f"Device event consumer failed, retrying: {e}")
+            self._set_live(False)
+            await asyncio.sleep(5)
+
+    def _set_live(self, live: bool):
+        if self.mirror:
+            self.mirror.set_live(live)
+
+    async def _local_events(self) -> AsyncIterator[tuple]:
+        self._set_live(True)
+        while True:
+            yield await self.producer.queue.get()
+
+    async def _kafka_events(self) -> AsyncIterator[tuple]:
+        consumer = AIOKafkaConsumer(
+            KAFKA_DEVICE_EVENTS_TOPIC, KAFKA_HEARTBEATS_TOPIC, KAFKA_ALERTS_TOPIC,
+            bootstrap_servers=KAFKA_BROKERS, group_id=None, auto_offset_reset="latest",
+        )
+        await consumer.start()
+        try:
+            self._set_live(True)
+            logger.info(f"Consuming device events from {KAFKA_BROKERS}")
+            async for message in consumer:
+                try:
+                    yield message.topic, json.loads(message.value)
+                except ValueError:
+                    logger.warning(f"Skipping malformed event on {message.topic}")
+        finally:
+            await consumer.stop()
+
+
+# Filler that doesn't change what a request asks for
+PLAN_FILLER_WORDS = {"please", "can", "could", "would", "you", "hey", "hi", "thanks", "thank", "just", "the", "a", "an", "me"}
+
+# Words that refer back to earlier turns; their plans depend on history, not just the message
+PLAN_CONTEXT_WORDS = {"it", "its", "them", "that", "those", "this", "these", "again", "same", "instead", "too", "also"}
+
+_CONTRACTIONS = [("what's", "what is"), ("where's", "where is"), ("how's", "how is"), ("it's", "it is"),
+                 ("n't", " not"), ("'re", " are"), ("'m", " am"), ("'ll", " will")]
+
+
+def _plan_cache_key(message: str, catalog: Dict) -> Optional[str]:
+    """Cache key for a Gemini plan, or None if the plan can't be reused safely."""
+    if catalog.get("error"):
+        return None
+
+    text = message.lower().replace("\u2019", "'")
+    for contraction, expansion in _CONTRACTIONS:
+        text = text.replace(contraction, expansion)
+    words = re.findall(r"[a-z0-9]+", text)
+    if not words or PLAN_CONTEXT_WORDS.intersection(words):
+        return None
+    normalized = " ".join(w for w in words if w not in PLAN_FILLER_WORDS)
+
+    # Plans reference device ids/names/types, not their current state
+    fingerprint = hashlib.sha1()
+    for device in sorted(catalog.get("devices") or [], key=lambda d: d.get("id", "")):
+        fingerprint.update(f"{device.get('id')}\x1f{device.get('name')}\x1f{device.get('type')}\x1e".encode())
+    return f"{normalized}|{fingerprint.hexdigest()}"
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough Gemini token count: about four characters per token for English text."""
+    return (len(text) + 3) // 4
+
+
+# Lines of a formatted reply that list items: bullets and table rows
+_DETAIL_LINE = re.compile(r"^\s*(?:[•·*-]\s|\|)")
+_LISTED_NAME = re.compile(r"\*\*(.+?)\*\*|^\s*[•·*-]\s+([^:(|]+?)\s*[:(]")
+_HISTORY_LISTED_NAMES = 8
+
+
+def _compact_model_text(text: str, max_tokens: int) -> str:
+    """A model reply cut down to what a follow-up might refer back to.
+
+    Short replies are kept (minus markdown). Longer ones drop their bullet and
+    table lines, keeping the headline plus the names those lines listed, then
+    are truncated to max_tokens.
+    """
+    text = re.sub(r"\n\s*\n", "\n", text.strip())
+    if _estimate_tokens(text) > max_tokens:
+        kept, names = [], []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped or set(stripped) <= set("|-: "):
+                continue
+            if _DETAIL_LINE.match(stripped):
+                match = _LISTED_NAME.search(stripped)
+                if match:
+                    names.append(match.group(1) or match.group(2))
+                continue
+            if stripped.startswith("_") and stripped.endswith("_"):
+                continue  # Freshness and stale-data notes
+            kept.append(stripped)
+        if names:
+            more = len(names) - _HISTORY_LISTED_NAMES
+            kept.append(f"({', '.join(names[:_HISTORY_LISTED_NAMES])}{f' and {more} more' if more > 0 else ''})")
+        text = " ".join(kept)
+
+    text = text.replace("**", "")
+    if _estimate_tokens(text) > max_tokens:
+        text = text[:max_tokens * 4 - 1].rstrip() + "…"
+    return text
+
+
+def _compact_history(history: List[Dict], budget: int) -> List[Dict]:
+    """Newest history entries that fit the token budget, model replies compacted.
+
+    The latest entry (the message being planned) is always sent whole.
+    """
+    compacted: List[Dict] = []
+    used = 0
+    for entry in reversed(history[-GEMINI_HISTORY_MAX_ENTRIES:]):
+        text = "".join(part.get("text", "") for part in entry.get("parts", []))
+        if compacted and entry.get("role") == "model":
+            text = _compact_model_text(text, GEMINI_HISTORY_MODEL_TURN_TOKENS)
+        cost = _estimate_tokens(text)
+        if compacted and used + cost > budget:
+            break
+        compacted.append({"role": entry.get("role", "user"), "parts": [{"text": text}]})
+        used += cost
+
+    # Follow the priming exchange with a user turn, as a real conversation would
+    while len(compacted) > 1 and compacted[-1]["role"] == "model":
+        used -= _estimate_tokens(compacted.pop()["parts"][0]["text"])
+    compacted.reverse()
+
+    gemini_history_tokens.labels(stage="raw").observe(
+        sum(_estimate_tokens(part.get("text", "")) for entry in history[-GEMINI_HISTORY_MAX_ENTRIES:]
+            for part in entry.get("parts", []))
+    )
+    gemini_history_tokens.labels(stage="compacted").observe(used)
+    return compacted
+
+
+class PlanCache:
+    """LRU + TTL cache of Gemini plans: (response text, functionCall list)."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[tuple[str, List[Dict]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, plan: tuple[str, List[Dict]]):
+        self._entries[key] = (time.monotonic() + self.ttl, plan)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Server-requested retry delay from a Retry-After header or Gemini's RetryInfo detail."""
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    try:
+        details = response.json().get("error", {}).get("details", [])
+    except ValueError:
+        return None
+    for detail in details:
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                pass
+    return None
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies for percentile estimates."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int) -> Optional[float]:
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class GeminiAdmissionController:
+    """Token-bucket rate limiter with a bounded priority queue in front of Gemini.
+
+    Requests that can't get a token right away wait in priority order (first
+    attempts before retries). A request whose estimated wait would run past its
+    deadline, or that finds the queue full, is shed immediately so the caller
+    can answer "busy" instead of burning its budget on a certain 429.
+    """
+
+    def __init__(self, rate: float, burst: int, max_queue: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._queue: List[tuple] = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free and nobody is queued ahead."""
+        self._refill()
+        if self._waiting == 0 and self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, deadline: float, priority: int = 0) -> bool:
+        """Wait for a token; False means the request was shed."""
+        if self.try_acquire():
+            gemini_admission.labels(outcome="admitted").inc()
+            gemini_queue_wait.observe(0)
+            return True
+
+        ahead = sum(1 for p, _, f in self._queue if p <= priority and not f.done())
+        estimated_wait = max(0.0, (ahead + 1 - self._tokens) / self.rate)
+        if self._waiting >= self.max_queue or time.monotonic() + estimated_wait > deadline:
+            gemini_admission.labels(outcome="shed").inc()
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._waiting += 1
+        gemini_queue_depth.set(self._waiting)
+        self._schedule()
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=max(0.0, deadline - started))
+            gemini_admission.labels(outcome="admitted").inc()
+            return True
+        except asyncio.TimeoutError:
+            gemini_admission.labels(outcome="shed").inc()
+            return False
+        finally:
+            self._waiting -= 1
+            gemini_queue_depth.set(self._waiting)
+            gemini_queue_wait.observe(time.monotonic() - started)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _schedule(self):
+        if self._timer is None:
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while self._queue and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue  # Waiter already gave up
+            self._tokens -= 1
+            future.set_result(None)
+
+        while self._queue and self._queue[0][2].done():
+            heapq.heappop(self._queue)
+        if self._queue:
+            self._schedule()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing.
+
+    After failure_threshold failures in a row the breaker opens and calls fail
+    fast for reset_timeout seconds. Then one probe is let through (half-open):
+    success closes the breaker, failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, upstream: str, failure_threshold: int, reset_timeout: float):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._state_gauge = circuit_state.labels(upstream=upstream)
+        self._rejected = circuit_rejected.labels(upstream=upstream)
+        self._state_gauge.set(self.state)
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self._rejected.inc()
+                return False
+            self._set_state(self.HALF_OPEN)
+            self._probe_started = None
+
+        # One probe at a time; a probe that never reported back is replaced after reset_timeout
+        if self._probe_started is None or now - self._probe_started > self.reset_timeout:
+            self._probe_started = now
+            return True
+        self._rejected.inc()
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit breaker for {self.upstream} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit breaker for {self.upstream} opened after {self._failures} failures")
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: int):
+        self.state = state
+        self._state_gauge.set(state)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight task."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, call: str, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            device_service_reads.labels(call=call, outcome="issued").inc()
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            device_service_reads.labels(call=call, outcome="coalesced").inc()
+
+        # Shield so one cancelled caller doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when every waiter went away
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that exports pool metrics for one upstream.
+
+    Pool wait is measured from the request entering the transport to the first
+    httpcore trace event of actual work (connecting or sending headers).
+    """
+
+    def __init__(self, upstream: str, limits: httpx.Limits, http2: bool = False):
+        self.upstream = upstream
+        self._transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+        self._pool_wait = http_pool_wait.labels(upstream=upstream)
+        self._in_flight = http_in_flight.labels(upstream=upstream)
+
+        http_pool_max_connections.labels(upstream=upstream).set(limits.max_connections or 0)
+        pool = self._transport._pool  # httpcore pool; httpx doesn't expose it publicly
+        http_pool_connections.labels(upstream=upstream, state="active").set_function(
+            lambda: sum(1 for c in pool.connections if not c.is_idle()))
+        http_pool_connections.labels(upstream=upstream, state="idle").set_function(
+            lambda: sum(1 for c in pool.connections if c.is_idle()))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        waiting = True
+        outer_trace = request.extensions.get("trace")
+
+        async def trace(event: str, info: Dict):
+            nonlocal waiting
+            if waiting and event.endswith((".connect_tcp.started", ".send_request_headers.started")):
+                waiting = False
+                self._pool_wait.observe(time.monotonic() - started)
+            if outer_trace:
+                await outer_trace(event, info)
+
+        request.extensions["trace"] = trace
+        self._in_flight.inc()
+        try:
+            return await self._transport.handle_async_request(request)
+        finally:
+            self._in_flight.dec()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _upstream_client(upstream: str, max_connections: int, max_keepalive: int,
+                     timeout: httpx.Timeout, http2: bool = False) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    return httpx.AsyncClient(transport=InstrumentedTransport(upstream, limits, http2), timeout=timeout)
+
 
 class AgenticAI:
     """Main AI agent class - optimized for minimal Gemini API calls."""
 
     def __init__(self):
-        self.http_client = httpx.AsyncClient(timeout=30.0)
+        self.gemini_client = _upstream_client(
+            "gemini", GEMINI_MAX_CONNECTIONS, GEMINI_MAX_KEEPALIVE_CONNECTIONS,
+            httpx.Timeout(GEMINI_TIMEOUT_SECONDS, connect=GEMINI_CONNECT_TIMEOUT_SECONDS), http2=GEMINI_HTTP2
+        )
+        # device-service is plain HTTP inside the cluster, so HTTP/1.1 keep-alive it is
+        self.device_client = _upstream_client(
+            "device_service", DEVICE_SERVICE_MAX_CONNECTIONS, DEVICE_SERVICE_MAX_KEEPALIVE_CONNECTIONS,
+            httpx.Timeout(DEVICE_SERVICE_TIMEOUT_SECONDS, connect=DEVICE_SERVICE_CONNECT_TIMEOUT_SECONDS)
+        )
+        if state_client:
+            self.device_cache = SharedDeviceCatalogCache(DEVICE_CACHE_MAX_USERS, DEVICE_CACHE_TTL_SECONDS, state_client)
+        else:
+            self.device_cache = DeviceCatalogCache(DEVICE_CACHE_MAX_USERS, DEVICE_CACHE_TTL_SECONDS)
+        self.device_reads = SingleFlight()
+        self.device_mirror = DeviceStateMirror(DEVICE_CACHE_MAX_USERS, DEVICE_MIRROR_RESEED_SECONDS)
+        self.analytics = DeviceAnalyticsStore(ANALYTICS_MAX_USERS, ANALYTICS_MAX_EVENTS_PER_USER, ANALYTICS_RETENTION_SECONDS)
+        self.device_events = None
+        if DEVICE_STATE_MIRROR != "off":
+            if ANALYTICS_EVENT_FEED not in ("off", DEVICE_STATE_MIRROR):
+                logger.warning(f"ANALYTICS_EVENT_FEED={ANALYTICS_EVENT_FEED} ignored; analytics shares "
+                               f"the mirror's {DEVICE_STATE_MIRROR} feed")
+            self.device_events = DeviceEventConsumer(self.device_mirror, self.analytics, DEVICE_STATE_MIRROR)
+        elif ANALYTICS_EVENT_FEED != "off":
+            self.device_events = DeviceEventConsumer(None, self.analytics, ANALYTICS_EVENT_FEED)
+        self.status_cache = DeviceStatusCache(STATUS_CACHE_MAX_ENTRIES, STATUS_CACHE_MAX_STALE_SECONDS)
+        self._refreshes: set = set()
+        self.device_breaker = CircuitBreaker(
+            "device_service", DEVICE_SERVICE_BREAKER_FAILURES, DEVICE_SERVICE_BREAKER_RESET_SECONDS
+        )
+        self.plan_cache = PlanCache(PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL_SECONDS)
+        self.gemini_latency = LatencyTracker()
+        self.gemini_admission = GeminiAdmissionController(GEMINI_RATE_PER_SECOND, GEMINI_BURST, GEMINI_QUEUE_MAX)
+
+    async def start(self):
+        if self.device_events:
+            await self.device_events.start()
 
     async def close(self):
-        await self.http_client.aclose()
+        if self.device_events:
+            await self.device_events.close()
+        await self.gemini_client.aclose()
+        await self.device_client.aclose()
 
-    async def chat(self, user_id: str, message: str, conversation_id: Optional[str] = None) -> ChatResponse:
+    async def chat(self, user_id: str, message: str, conversation_id: Optional[str] = None,
+                   debug: bool = False) -> ChatResponse:
         """Process a chat message with optimized Gemini usage."""
 
         logger.info(f"Chat called with user_id={user_id}, message='{message}'")
 
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        request_timings.set(timings)
+
+        def debug_timings() -> Optional[Dict[str, float]]:
+            if not debug:
+                return None
+            breakdown = {name: round(seconds * 1000, 2) for name, seconds in timings.items()}
+            breakdown["total"] = round((time.perf_counter() - started) * 1000, 2)
+            return breakdown
+
         with chat_latency.time():
             try:
+                deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
                 if not conversation_id:
                     conversation_id = str(uuid4())
 
-                if conversation_id not in conversations:
-                    conversations[conversation_id] = []
-
-                history = conversations[conversation_id]
-                history.append({"role": "user", "parts": [{"text": message}]})
+                await conversation_store.append(conversation_id, user_id, {"role": "user", "parts": [{"text": message}]})
 
                 # Try to handle locally first (no Gemini call)
                 logger.info(f"About to try local handling...")
                 local_result = await self._try_local_handling(user_id, message)
                 logger.info(f"Local handling result: {local_result is not None}")
                 if local_result:
+                    request_route.set("local")
                     response_text, actions_taken = local_result
                 else:
                     # Need Gemini - make ONE call to get all tool calls
-                    response_text, actions_taken = await self._call_gemini_optimized(user_id, message, history)
+                    history = await conversation_store.history(conversation_id, user_id)
+                    response_text, actions_taken = await self._call_gemini_optimized(user_id, message, history, deadline)
 
-                history.append({"role": "model", "parts": [{"text": response_text}]})
-
-                if len(history) > 20:
-                    history = history[-20:]
-                conversations[conversation_id] = history
+                await conversation_store.append(conversation_id, user_id, {"role": "model", "parts": [{"text": response_text}]})
 
                 chat_requests.labels(status="success").inc()
+                chat_routes.labels(route=request_route.get()).inc()
 
                 return ChatResponse(
                     id=str(uuid4()),
@@ -210,7 +2699,8 @@ class AgenticAI:
                     message=response_text,
                     actions_taken=actions_taken,
                     suggestions=self._generate_suggestions(message, response_text),
-                    timestamp=datetime.utcnow().isoformat()
+                    timestamp=datetime.utcnow().isoformat(),
+                    timings=debug_timings()
                 )
 
             except HTTPException as e:
@@ -223,7 +2713,8 @@ class AgenticAI:
                     actions_taken=[],
                     suggestions=[],
                     timestamp=datetime.utcnow().isoformat(),
-                    error=e.detail if hasattr(e, 'detail') else str(e)
+                    error=e.detail if hasattr(e, 'detail') else str(e),
+                    timings=debug_timings()
                 )
             except Exception as e:
                 logger.error(f"Chat error: {e}")
@@ -235,160 +2726,224 @@ class AgenticAI:
                     actions_taken=[],
                     suggestions=[],
                     timestamp=datetime.utcnow().isoformat(),
-                    error=str(e)
+                    error=str(e),
+                    timings=debug_timings()
                 )
 
+    async def chat_stream(self, user_id: str, message: str, conversation_id: Optional[str] = None,
+                          debug: bool = False) -> AsyncIterator[str]:
+        """Run a chat turn and yield SSE frames as it progresses."""
+        conversation_id = conversation_id or str(uuid4())
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run() -> ChatResponse:
+            try:
+                return await self.chat(user_id, message, conversation_id, debug)
+            finally:
+                queue.put_nowait(None)
+
+        # Run the turn in its own context so only this request's tools emit into the queue
+        ctx = contextvars.copy_context()
+        ctx.run(stream_events.set, queue)
+        task = asyncio.create_task(run(), context=ctx)
+
+        yield _sse("start", {"conversation_id": conversation_id})
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield _sse(*item)
+
+        response = await task
+        if response.error:
+            yield _sse("error", {"error": response.error})
+        for chunk in _chunk_text(response.message, STREAM_CHUNK_CHARS):
+            yield _sse("message", {"text": chunk})
+        yield _sse("done", response.model_dump())
+
+    def _record_action(self, actions_taken: List[Dict], tool: str, args: Dict, result: Dict):
+        """Append an executed tool call to actions_taken and stream it to the client."""
+        action = {"tool": tool, "args": args, "result": result}
+        actions_taken.append(action)
+        _emit("tool_result", action)
+
     async def _try_local_handling(self, user_id: str, message: str) -> Optional[tuple[str, List[Dict]]]:
         """Try to handle common requests locally without calling Gemini."""
 
         msg_lower = message.lower().strip()
-        actions_taken = []
-
         logger.info(f"Checking local handling for: '{msg_lower}'")
 
-        # Pattern: List devices
-        device_patterns = ["what devices", "list devices", "show devices", "my devices", "all devices", "do i have"]
-        if any(p in msg_lower for p in device_patterns) and "status" not in msg_lower:
-            result = await self._tool_list_devices(user_id, {})
-            actions_taken.append({"tool": "list_devices", "args": {}, "result": result})
-            response = self._format_device_list(result)
-            return response, actions_taken
-
-        # Pattern: All device status
-        if any(p in msg_lower for p in ["status of all", "all device status", "all status", "status of my devices", "show me all device"]):
-            result = await self._tool_get_all_device_statuses(user_id, {})
-            actions_taken.append({"tool": "get_all_device_statuses", "args": {}, "result": result})
-            response = self._format_all_device_statuses(result)
-            return response, actions_taken
-
-        # Pattern: Status of specific device (e.g., "status of front door", "is the door locked")
-        status_patterns = ["status of", "what is the status", "is the", "check the", "how is the"]
-        if any(p in msg_lower for p in status_patterns):
-            # Extract device reference
-            devices_result = await self._tool_list_devices(user_id, {})
-            devices = devices_result.get("devices", [])
-            for device in devices:
-                device_name_lower = device.get("name", "").lower()
-                device_type = device.get("type", "")
-                # Check if device name or type words are in the message
-                name_words = device_name_lower.split()
-                if any(word in msg_lower for word in name_words if len(word) > 2):
-                    # Found a matching device - get its status
-                    status_result = await self._tool_get_device_status(user_id, {"device_id": device["id"]})
-                    actions_taken.append({"tool": "list_devices", "args": {}, "result": devices_result})
-                    actions_taken.append({"tool": "get_device_status", "args": {"device_id": device["id"]}, "result": status_result})
-                    response = self._format_single_device_status(device, status_result)
-                    return response, actions_taken
-
-        # Pattern: Turn on/off ALL lights
-        for action, cmd in [("turn on", "turn_on"), ("turn off", "turn_off"), ("switch on", "turn_on"), ("switch off", "turn_off")]:
-            if action in msg_lower and "all" in msg_lower and "light" in msg_lower:
-                devices_result = await self._tool_list_devices(user_id, {"device_type": "light"})
-                lights = devices_result.get("devices", [])
-                if lights:
-                    for light in lights:
-                        cmd_result = await self._tool_send_device_command(user_id, {
-                            "device_id": light["id"],
-                            "command": cmd
-                        })
-                        actions_taken.append({"tool": "send_device_command", "args": {"device_id": light["id"], "command": cmd}, "result": cmd_result})
-
-                    state = "on" if cmd == "turn_on" else "off"
-                    response = f"Done! I've turned {state} all {len(lights)} light(s)."
-                    return response, actions_taken
-
-        # Pattern: Turn on/off specific device
-        for action, cmd in [("turn on", "turn_on"), ("turn off", "turn_off"), ("switch on", "turn_on"), ("switch off", "turn_off")]:
-            if action in msg_lower:
-                # Find device name in message
-                device_name = self._extract_device_name(msg_lower, action)
-                if device_name:
-                    # Get device list to find ID
-                    devices_result = await self._tool_list_devices(user_id, {})
-                    device = self._find_device_by_name(devices_result.get("devices", []), device_name)
-                    if device:
-                        cmd_result = await self._tool_send_device_command(user_id, {
-                            "device_id": device["id"],
-                            "command": cmd
-                        })
-                        actions_taken.append({"tool": "list_devices", "args": {}, "result": devices_result})
-                        actions_taken.append({"tool": "send_device_command", "args": {"device_id": device["id"], "command": cmd}, "result": cmd_result})
-
-                        state = "on" if cmd == "turn_on" else "off"
-                        response = f"Done! I've turned {state} the {device['name']}."
-                        return response, actions_taken
-
-        # Pattern: Lock/unlock door (check unlock first since "lock" is in "unlock")
-        for action, cmd in [("unlock", "unlock"), ("lock", "lock")]:
-            if action in msg_lower and ("door" in msg_lower or "lock" in msg_lower):
-                devices_result = await self._tool_list_devices(user_id, {"device_type": "smart_lock"})
-                devices = devices_result.get("devices", [])
-                if devices:
-                    device = devices[0]  # Use first lock found
-                    cmd_result = await self._tool_send_device_command(user_id, {
-                        "device_id": device["id"],
-                        "command": cmd
-                    })
-                    actions_taken.append({"tool": "list_devices", "args": {"device_type": "smart_lock"}, "result": devices_result})
-                    actions_taken.append({"tool": "send_device_command", "args": {"device_id": device["id"], "command": cmd}, "result": cmd_result})
-
-                    response = f"Done! I've {action}ed the {device['name']}."
-                    return response, actions_taken
-
-        # Pattern: Set temperature
-        if "temperature" in msg_lower or "thermostat" in msg_lower:
-            import re
-            temp_match = re.search(r'(\d+)\s*(?:degrees?|°|f)?', msg_lower)
-            if temp_match and ("set" in msg_lower or "to" in msg_lower):
-                temp = int(temp_match.group(1))
-                devices_result = await self._tool_list_devices(user_id, {"device_type": "thermostat"})
-                devices = devices_result.get("devices", [])
-                if devices:
-                    device = devices[0]
-                    cmd_result = await self._tool_send_device_command(user_id, {
-                        "device_id": device["id"],
-                        "command": "set_temperature",
-                        "parameters": {"temperature": temp}
-                    })
-                    actions_taken.append({"tool": "list_devices", "args": {"device_type": "thermostat"}, "result": devices_result})
-                    actions_taken.append({"tool": "send_device_command", "args": {"device_id": device["id"], "command": "set_temperature", "parameters": {"temperature": temp}}, "result": cmd_result})
-
-                    response = f"Done! I've set the {device['name']} to {temp}°F."
-                    return response, actions_taken
-
-        # Pattern: Get analytics
-        if any(p in msg_lower for p in ["analytics", "usage", "activity", "summary", "insights"]):
-            period = "day"
-            if "week" in msg_lower:
-                period = "week"
-            elif "month" in msg_lower:
-                period = "month"
-
-            result = await self._tool_get_analytics(user_id, {"period": period})
-            actions_taken.append({"tool": "get_analytics", "args": {"period": period}, "result": result})
-            response = self._format_analytics(result)
-            return response, actions_taken
+        # Intents come back in priority order; a handler returning None falls through to the next
+        intents = intent_router.classify(msg_lower)
+        while True:
+            with _stage("intent_match"):
+                intent = next(intents, None)
+            if intent is None:
+                break
+            handler = getattr(self, f"_handle_{intent.name}")
+            token = current_tool.set(intent.name)
+            try:
+                result = await handler(user_id, msg_lower, intent.slots)
+            finally:
+                current_tool.reset(token)
+            if result:
+                return result
 
         return None  # Need Gemini for complex requests
 
-    def _extract_device_name(self, message: str, action: str) -> Optional[str]:
-        """Extract device name from message."""
-        # Remove the action words
-        text = message.replace(action, "").strip()
-        # Remove common words
-        for word in ["the", "my", "please", "can you", "could you", "device", "for me"]:
-            text = text.replace(word, "").strip()
-        return text if text else None
-
-    def _find_device_by_name(self, devices: List[Dict], name: str) -> Optional[Dict]:
-        """Find device by partial name match."""
-        name_lower = name.lower()
-        for device in devices:
-            device_name = device.get("name", "").lower()
-            if name_lower in device_name or device_name in name_lower:
-                return device
-        return None
+    async def _handle_list_devices(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        result = await self._tool_list_devices(user_id, {})
+        self._record_action(actions_taken, "list_devices", {}, result)
+        return self._format_device_list(result), actions_taken
+
+    async def _handle_all_device_status(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        result = await self._tool_get_all_device_statuses(user_id, {})
+        self._record_action(actions_taken, "get_all_device_statuses", {}, result)
+        return self._format_all_device_statuses(result), actions_taken
+
+    async def _handle_device_status(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        # Status of specific device (e.g., "status of front door", "is the door locked")
+        actions_taken = []
+        devices_result = await self._tool_list_devices(user_id, {})
+        device = self.device_cache.name_index(user_id, "", devices_result).resolve(msg_lower)
+        if not device:
+            return None
+
+        status_result = await self._tool_get_device_status(user_id, {"device_id": device["id"]})
+        self._record_action(actions_taken, "list_devices", {}, devices_result)
+        self._record_action(actions_taken, "get_device_status", {"device_id": device["id"]}, status_result)
+        return self._format_single_device_status(device, status_result), actions_taken
+
+    async def _handle_all_lights(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        cmd = slots["command"]
+        devices_result = await self._tool_list_devices(user_id, {"device_type": "light"})
+        lights = devices_result.get("devices", [])
+        if not lights:
+            return None
+
+        results = await self._bulk_send_device_command(user_id, lights, cmd)
+        for light, cmd_result in zip(lights, results):
+            self._record_action(actions_taken, "send_device_command", {"device_id": light["id"], "command": cmd}, cmd_result)
 
+        state = "on" if cmd == "turn_on" else "off"
+        return self._format_bulk_result(f"turned {state}", "light(s)", lights, results), actions_taken
+
+    async def _handle_device_power(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        cmd = slots["command"]
+        devices_result = await self._tool_list_devices(user_id, {})
+        index = self.device_cache.name_index(user_id, "", devices_result)
+        state = "on" if cmd == "turn_on" else "off"
+        device = index.resolve(slots["device_name"])
+        if not device:
+            # "turn off the lights": every device the plural names; anything vaguer goes to Gemini
+            group = index.group(slots["device_name"])
+            if len(group) < 2:
+                return None
+            self._record_action(actions_taken, "list_devices", {}, devices_result)
+            results = await self._bulk_send_device_command(user_id, group, cmd)
+            for target, cmd_result in zip(group, results):
+                self._record_action(actions_taken, "send_device_command", {"device_id": target["id"], "command": cmd}, cmd_result)
+            return self._format_bulk_result(f"turned {state}", "device(s)", group, results), actions_taken
+
+        cmd_result = await self._tool_send_device_command(user_id, {
+            "device_id": device["id"],
+            "command": cmd
+        })
+        self._record_action(actions_taken, "list_devices", {}, devices_result)
+        self._record_action(actions_taken, "send_device_command", {"device_id": device["id"], "command": cmd}, cmd_result)
+
+        return f"Done! I've turned {state} the {device['name']}.", actions_taken
+
+    async def _handle_lock(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        cmd = slots["command"]
+        devices_result = await self._tool_list_devices(user_id, {"device_type": "smart_lock"})
+        devices = devices_result.get("devices", [])
+        if not devices:
+            return None
+
+        self._record_action(actions_taken, "list_devices", {"device_type": "smart_lock"}, devices_result)
+        index = self.device_cache.name_index(user_id, "smart_lock", devices_result)
+        # "lock all doors" targets every lock; "lock the back doors" the ones that plural names
+        targets = devices if slots["all"] else index.group(msg_lower)
+        if len(targets) > 1:
+            results = await self._bulk_send_device_command(user_id, targets, cmd)
+            for device, cmd_result in zip(targets, results):
+                self._record_action(actions_taken, "send_device_command", {"device_id": device["id"], "command": cmd}, cmd_result)
+            return self._format_bulk_result(f"{cmd}ed", "lock(s)", targets, results), actions_taken
+
+        # The lock the user named ("unlock the back door"), else the first one
+        device = index.resolve(msg_lower) or devices[0]
+        cmd_result = await self._tool_send_device_command(user_id, {
+            "device_id": device["id"],
+            "command": cmd
+        })
+        self._record_action(actions_taken, "send_device_command", {"device_id": device["id"], "command": cmd}, cmd_result)
+        return f"Done! I've {cmd}ed the {device['name']}.", actions_taken
+
+    async def _handle_set_temperature(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        temp = slots["temperature"]
+        devices_result = await self._tool_list_devices(user_id, {"device_type": "thermostat"})
+        devices = devices_result.get("devices", [])
+        if not devices:
+            return None
+
+        device = self.device_cache.name_index(user_id, "thermostat", devices_result).resolve(msg_lower) or devices[0]
+        cmd_result = await self._tool_send_device_command(user_id, {
+            "device_id": device["id"],
+            "command": "set_temperature",
+            "parameters": {"temperature": temp}
+        })
+        self._record_action(actions_taken, "list_devices", {"device_type": "thermostat"}, devices_result)
+        self._record_action(actions_taken, "send_device_command", {"device_id": device["id"], "command": "set_temperature", "parameters": {"temperature": temp}}, cmd_result)
+        return f"Done! I've set the {device['name']} to {temp}°F.", actions_taken
+
+    async def _handle_analytics(self, user_id: str, msg_lower: str, slots: Dict) -> Optional[tuple[str, List[Dict]]]:
+        actions_taken = []
+        period = slots["period"]
+        result = await self._tool_get_analytics(user_id, {"period": period})
+        self._record_action(actions_taken, "get_analytics", {"period": period}, result)
+        return self._format_analytics(result), actions_taken
+
+    async def _bulk_send_device_command(self, user_id: str, devices: List[Dict], command: str,
+                                        parameters: Optional[Dict] = None) -> List[Dict]:
+        """Send the same command to many devices concurrently, one result per device.
+
+        A failing device never aborts the others; its result carries success=False.
+        """
+        semaphore = asyncio.Semaphore(BULK_COMMAND_CONCURRENCY)
+
+        async def send(device: Dict) -> Dict:
+            args = {"device_id": device["id"], "command": command}
+            if parameters:
+                args["parameters"] = parameters
+            async with semaphore:
+                try:
+                    return await self._tool_send_device_command(user_id, args)
+                except Exception as e:
+                    logger.error(f"Bulk command {command} failed for {device['id']}: {e}")
+                    return {"success": False, "error": str(e)}
+
+        return await asyncio.gather(*[send(d) for d in devices])
+
+    @_timed_stage("response_formatting")
+    def _format_bulk_result(self, verb: str, noun: str, devices: List[Dict], results: List[Dict]) -> str:
+        """Summarize a bulk command, naming any devices that failed."""
+        failed = [d.get("name", d["id"]) for d, r in zip(devices, results) if not r.get("success")]
+        if not failed:
+            return f"Done! I've {verb} all {len(devices)} {noun}."
+        if len(failed) == len(devices):
+            return f"⚠️ I couldn't reach any of your {len(devices)} {noun}. Please try again."
+        succeeded = len(devices) - len(failed)
+        return f"I've {verb} {succeeded} of {len(devices)} {noun}. ⚠️ Failed: {', '.join(failed)}."
+
+    @_timed_stage("response_formatting")
     def _format_device_list(self, result: Dict) -> str:
         """Format device list for display."""
         devices = result.get("devices", [])
@@ -400,8 +2955,11 @@ class AgenticAI:
             status = "🟢 online" if d.get("online") else "🔴 offline"
             lines.append(f"• **{d['name']}** ({d['type']}) - {status}")
 
+        if result.get("stale"):
+            lines.append(STALE_DATA_NOTE)
         return "\n".join(lines)
 
+    @_timed_stage("response_formatting")
     def _format_all_device_statuses(self, result: Dict) -> str:
         """Format all device statuses for display."""
         statuses = result.get("statuses", [])
@@ -447,17 +3005,21 @@ class AgenticAI:
                     lines.append(f"  • {name}: {state}")
             lines.append("")
 
+        # Report the oldest reading, so the footer never overstates freshness
+        ages = [s["age_seconds"] for s in statuses if s.get("age_seconds") is not None]
+        lines.extend(_freshness_lines(max(ages) if ages else None, bool(result.get("stale"))))
         return "\n".join(lines)
 
+    @_timed_stage("response_formatting")
     def _format_single_device_status(self, device: Dict, status_result: Dict) -> str:
         """Format single device status for display."""
         name = device.get("name", "Unknown")
         dtype = device.get("type", "")
-        config = device.get("config", {})
+        config = dict(device.get("config") or {})
 
-        # Merge status_result into config if it has additional data
-        if status_result and "device" in status_result:
-            config.update(status_result.get("device", {}).get("config", {}))
+        # The status payload is newer than the catalog entry
+        if status_result and not status_result.get("error"):
+            config.update(status_result.get("config") or {})
 
         lines = [f"**{name}** status:\n"]
 
@@ -486,8 +3048,11 @@ class AgenticAI:
         if location:
             lines.append(f"Location: {location}")
 
+        if status_result:
+            lines.extend(_freshness_lines(status_result.get("age_seconds"), bool(status_result.get("stale"))))
         return "\n".join(lines)
 
+    @_timed_stage("response_formatting")
     def _format_analytics(self, result: Dict) -> str:
         """Format analytics for display."""
         summary = result.get("summary", {})
@@ -498,7 +3063,6 @@ class AgenticAI:
             f"• Total events: {summary.get('total_events', 0)}",
             f"• Active devices: {summary.get('active_devices', 0)}",
             f"• Alerts: {summary.get('alerts', 0)}",
-            f"• Energy usage: {summary.get('energy_usage', 'N/A')}",
         ]
 
         if top_devices:
@@ -508,51 +3072,86 @@ class AgenticAI:
 
         return "\n".join(lines)
 
-    async def _call_gemini_optimized(self, user_id: str, message: str, history: List[Dict]) -> tuple[str, List[Dict]]:
-        """Call Gemini once to get all needed tool calls, execute them, generate response locally."""
-
-        gemini_calls.labels(type="planning").inc()
-
-        system_prompt = f"""You are HomeGuard AI. Analyze the user request and return the tool calls needed.
+    async def _call_gemini_optimized(self, user_id: str, message: str, history: List[Dict],
+                                     deadline: float) -> tuple[str, List[Dict]]:
+        """Plan tool calls (cached or one Gemini call), execute them, generate response locally."""
+
+        planning: Optional[asyncio.Task] = None
+        catalog = self.device_cache.get(user_id)
+        if catalog is None:
+            catalog = self.device_mirror.catalog(user_id)
+            if catalog is not None:
+                device_mirror_reads.labels(call="list_devices").inc()
+        if catalog is None:
+            # Cold catalog: plan with Gemini while it's fetched instead of after. The plan
+            # almost always starts with list_devices, which then joins this fetch or hits
+            # the cache it fills. Skip the speculation when the expired catalog already
+            # keys a cached plan: the device set rarely changes, so the fetch is likely
+            # to confirm the hit, and a hit must not spend a Gemini call or admission token.
+            stale = self.device_cache.get_stale(user_id)
+            stale_key = _plan_cache_key(message, stale) if stale is not None else None
+            if not (stale_key and self.plan_cache.get(stale_key) is not None):
+                planning = asyncio.create_task(self._plan_with_gemini(history, deadline))
+                planning.add_done_callback(lambda t: t.cancelled() or t.exception())
+            try:
+                catalog = await self._list_devices_uncached(user_id, "")
+            except BaseException:
+                if planning:
+                    planning.cancel()
+                raise
+
+        cache_key = _plan_cache_key(message, catalog)
+        plan = self.plan_cache.get(cache_key) if cache_key else None
+
+        if plan is not None:
+            if planning:
+                planning.cancel()
+            gemini_plan_cache.labels(result="hit").inc()
+            source = "plan_cache"
+            request_route.set(source)
+        else:
+            request_route.set("gemini")
+            if cache_key:
+                gemini_plan_cache.labels(result="miss").inc()
+            plan = await (planning or self._plan_with_gemini(history, deadline))
+            if plan is None:
+                return "I couldn't understand that request. Please try again.", []
+            if cache_key:
+                self.plan_cache.put(cache_key, plan)
+            source = "gemini"
+
+        response_text, tool_calls_to_execute = plan
+        _emit("plan", {"source": source, "tool_calls": tool_calls_to_execute})
 
-User ID: {user_id}
+        # Execute all tools locally (no more Gemini calls)
+        actions_taken = await self._execute_plan(user_id, tool_calls_to_execute)
 
-IMPORTANT: Return ALL tool calls needed in a single response. Don't wait for results.
-For device control: Use list_devices first to get IDs, then send_device_command.
-For status of all devices: Use get_all_device_statuses (one call, not multiple get_device_status).
+        # Generate response locally based on what was executed
+        if not response_text:
+            response_text = self._generate_response_from_actions(actions_taken)
 
-Be concise. Execute actions immediately without asking for confirmation."""
+        return response_text, actions_taken
 
-        contents = [
-            {"role": "user", "parts": [{"text": system_prompt}]},
-            {"role": "model", "parts": [{"text": "Ready to help."}]}
-        ] + history[-6:]  # Keep recent history short
+    async def _plan_with_gemini(self, history: List[Dict], deadline: float) -> Optional[tuple[str, List[Dict]]]:
+        """Make the single Gemini planning call; returns (text, tool calls) or None if nothing came back."""
 
-        function_declarations = [
-            {"name": t["name"], "description": t["description"], "parameters": t["parameters"]}
-            for t in TOOLS
-        ]
-
-        request_body = {
-            "contents": contents,
-            "tools": [{"function_declarations": function_declarations}],
-            "generationConfig": {
-                "temperature": 0.3,  # Lower for more deterministic tool selection
-                "maxOutputTokens": 512,
-            }
-        }
+        gemini_calls.labels(type="planning").inc()
 
-        url = f"{GEMINI_BASE_URL}/models/{GEMINI_TEXT_MODEL}:generateContent?key={GEMINI_TEXT_API_KEY}"
+        body = gemini_planning_request.render(_compact_history(history, GEMINI_HISTORY_TOKEN_BUDGET))
 
         # Call Gemini with retries
-        response = await self._call_gemini_with_retry(url, request_body)
+        token = current_tool.set("planning")
+        try:
+            response = await self._call_gemini_with_retry(gemini_planning_request.url, body, deadline)
+        finally:
+            current_tool.reset(token)
         if response is None:
             raise HTTPException(status_code=429, detail="AI service is busy. Please try again in a moment.")
 
         result = response.json()
         candidates = result.get("candidates", [])
         if not candidates:
-            return "I couldn't understand that request. Please try again.", []
+            return None
 
         content = candidates[0].get("content", {})
         parts = content.get("parts", [])
@@ -571,59 +3170,136 @@ Be concise. Execute actions immediately without asking for confirmation."""
                     "args": func_call.get("args", {})
                 })
 
-        # Execute all tools locally (no more Gemini calls)
-        actions_taken = []
-        tool_results = {}
-
-        for tc in tool_calls_to_execute:
-            logger.info(f"[Gemini path] Executing tool: {tc['name']} with args: {tc['args']}")
-            tool_calls.labels(tool_name=tc['name']).inc()
-
-            result = await self._execute_tool(user_id, tc['name'], tc['args'])
-            actions_taken.append({
-                "tool": tc['name'],
-                "args": tc['args'],
-                "result": result
-            })
-            tool_results[tc['name']] = result
-
-        # Generate response locally based on what was executed
-        if not response_text:
-            response_text = self._generate_response_from_actions(actions_taken)
-
-        return response_text, actions_taken
-
-    async def _call_gemini_with_retry(self, url: str, request_body: Dict) -> Optional[httpx.Response]:
-        """Call Gemini API with retry logic."""
-        max_retries = 5
-        retry_delay = 10.0
-
-        for attempt in range(max_retries):
+        return response_text, tool_calls_to_execute
+
+    async def _execute_plan(self, user_id: str, calls: List[Dict]) -> List[Dict]:
+        """Execute planned tool calls as a dependency DAG, independent calls concurrently."""
+        deps = _plan_dependencies(calls)
+        semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+        tasks: List[asyncio.Task] = []
+
+        async def run(index: int, call: Dict) -> Dict:
+            # Time spent waiting on dependencies and the concurrency limit
+            with _stage("tool_scheduling"):
+                if deps[index]:
+                    await asyncio.gather(*(tasks[j] for j in deps[index]))
+                await semaphore.acquire()
+            current_tool.set(call['name'])
             try:
-                response = await self.http_client.post(url, json=request_body)
+                logger.info(f"[Gemini path] Executing tool: {call['name']} with args: {call['args']}")
+                tool_calls.labels(tool_name=call['name']).inc()
+                result = await self._execute_tool(user_id, call['name'], call['args'])
+            finally:
+                semaphore.release()
+            _emit("tool_result", {"tool": call['name'], "args": call['args'], "result": result})
+            return result
+
+        # Dependencies only point backwards, so every awaited task exists before it's needed
+        for index, call in enumerate(calls):
+            tasks.append(asyncio.create_task(run(index, call)))
+        results = await asyncio.gather(*tasks)
+
+        # Report in plan order regardless of completion order
+        return [
+            {"tool": call['name'], "args": call['args'], "result": result}
+            for call, result in zip(calls, results)
+        ]
 
+    async def _call_gemini_with_retry(self, url: str, body: bytes, deadline: float) -> Optional[httpx.Response]:
+        """Call Gemini API, retrying with jittered backoff without outliving the chat deadline."""
+        for attempt in range(GEMINI_MAX_ATTEMPTS):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error("Gemini deadline exceeded before attempt could start")
+                return None
+
+            # Retries queue behind first attempts from other requests
+            with _stage("gemini_queue"):
+                admitted = await self.gemini_admission.acquire(deadline, priority=0 if attempt == 0 else 1)
+            if not admitted:
+                logger.warning("Gemini admission shed request: queue wait would exceed deadline")
+                return None
+            remaining = deadline - time.monotonic()
+
+            delay = None
+            try:
+                with _stage("gemini_network"):
+                    response = await self._post_gemini(url, body, min(remaining, GEMINI_TIMEOUT_SECONDS))
                 if response.status_code == 200:
                     return response
-                elif response.status_code == 429:
-                    if attempt < max_retries - 1:
-                        logger.warning(f"Rate limited, retrying in {retry_delay}s (attempt {attempt + 1}/{max_retries})")
-                        await asyncio.sleep(retry_delay)
-                        retry_delay = min(retry_delay * 2, 60.0)
-                    else:
-                        logger.error("Gemini API rate limit exceeded")
-                        return None
-                else:
+                if response.status_code not in GEMINI_RETRYABLE_STATUSES:
                     logger.error(f"Gemini API error: {response.status_code}")
                     return None
+                delay = _retry_after_seconds(response)
+                logger.warning(f"Gemini API returned {response.status_code} (attempt {attempt + 1}/{GEMINI_MAX_ATTEMPTS})")
             except Exception as e:
                 logger.error(f"Gemini API call failed: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-                else:
-                    return None
+
+            if delay is None:
+                delay = random.uniform(0, min(GEMINI_BACKOFF_MAX_SECONDS, GEMINI_BACKOFF_BASE_SECONDS * 2 ** attempt))
+            if attempt == GEMINI_MAX_ATTEMPTS - 1 or time.monotonic() + delay >= deadline:
+                logger.error("Gemini API retries exhausted within the request deadline")
+                return None
+
+            logger.info(f"Retrying Gemini in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
         return None
 
+    async def _post_gemini(self, url: str, body: bytes, timeout: float) -> httpx.Response:
+        """POST to Gemini, hedging with a second request if the first runs past the latency threshold."""
+        hedge_after = None
+        if GEMINI_HEDGE_PERCENTILE > 0:
+            hedge_after = self.gemini_latency.percentile(GEMINI_HEDGE_PERCENTILE, GEMINI_HEDGE_MIN_SAMPLES)
+        deadline = time.monotonic() + timeout
+
+        async def post() -> httpx.Response:
+            # A hedge starts late, so it only gets what is left of the caller's time
+            started = time.monotonic()
+            remaining = max(0.0, deadline - started)
+            with _upstream_call("gemini"):
+                response = await self.gemini_client.post(
+                    url, content=body, headers={"Content-Type": "application/json"},
+                    timeout=httpx.Timeout(remaining, connect=min(remaining, GEMINI_CONNECT_TIMEOUT_SECONDS))
+                )
+            if response.status_code == 200:
+                self.gemini_latency.record(time.monotonic() - started)
+            return response
+
+        primary = asyncio.ensure_future(post())
+        if hedge_after is None or hedge_after >= timeout:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+        if time.monotonic() >= deadline:
+            return await primary
+
+        # Hedges only use spare rate-limit capacity; never queue for one
+        if not self.gemini_admission.try_acquire():
+            return await primary
+
+        gemini_hedges.labels(outcome="sent").inc()
+        hedge = asyncio.ensure_future(post())
+        pending = {primary, hedge}
+        response = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        if task is hedge:
+                            gemini_hedges.labels(outcome="won").inc()
+                        return task.result()
+                    response = task
+            # Neither succeeded: surface the last failure to the retry loop
+            return response.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @_timed_stage("response_formatting")
     def _generate_response_from_actions(self, actions: List[Dict]) -> str:
         """Generate a human-readable response from executed actions."""
         if not actions:
@@ -645,7 +3321,9 @@ Be concise. Execute actions immediately without asking for confirmation."""
             elif tool == "get_device_status":
                 name = result.get("name", "Device")
                 state = result.get("state", result.get("status", "unknown"))
-                responses.append(f"**{name}**: {state}")
+                responses.append("\n".join(
+                    [f"**{name}**: {state}"] + _freshness_lines(result.get("age_seconds"), bool(result.get("stale")))
+                ))
 
             elif tool == "send_device_command":
                 if result.get("success"):
@@ -687,28 +3365,142 @@ Be concise. Execute actions immediately without asking for confirmation."""
             return {"error": str(e)}
 
     async def _tool_list_devices(self, user_id: str, args: Dict) -> Dict:
-        """List user's devices."""
+        """List user's devices, served from the catalog cache while fresh."""
+        device_type = args.get("device_type") or ""
+        cached = self.device_cache.get(user_id, device_type)
+        if cached is not None:
+            return cached
+        mirrored = self.device_mirror.catalog(user_id, device_type)
+        if mirrored is not None:
+            device_mirror_reads.labels(call="list_devices").inc()
+            return mirrored
+        return await self._list_devices_uncached(user_id, device_type)
+
+    async def _list_devices_uncached(self, user_id: str, device_type: str) -> Dict:
+        """Fetch the catalog, falling back to the expired cached copy if device-service is down."""
+        try:
+            result = await self.device_reads.do(
+                "list_devices", ("list_devices", user_id, device_type),
+                lambda: self._fetch_device_list(user_id, device_type)
+            )
+        except (CircuitOpenError, httpx.TransportError) as e:
+            logger.warning(f"device-service unavailable listing devices: {e}")
+            result = {"devices": [], "error": "Device service unavailable"}
+
+        if result.get("error"):
+            stale = self.device_cache.get_stale(user_id, device_type)
+            if stale is not None:
+                return {**stale, "stale": True}
+        return result
+
+    async def _device_request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Call device-service through its circuit breaker; transport errors and 5xx count as failures."""
+        if not self.device_breaker.allow():
+            raise CircuitOpenError("device-service circuit breaker is open")
+        try:
+            with _upstream_call("device_service"):
+                response = await self.device_client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            self.device_breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.device_breaker.record_failure()
+        else:
+            self.device_breaker.record_success()
+        return response
+
+    async def _fetch_device_list(self, user_id: str, device_type: str) -> Dict:
+        """GET /devices from device-service and populate the catalog cache."""
+        generation = self.device_cache.generation(user_id)
         url = f"{DEVICE_SERVICE_URL}/devices"
         params = {}
-        if args.get("device_type"):
-            params["type"] = args["device_type"]
+        if device_type:
+            params["type"] = device_type
 
-        response = await self.http_client.get(url, params=params, headers={"X-User-ID": user_id})
+        response = await self._device_request("GET", url, params=params, headers={"X-User-ID": user_id})
         if response.status_code == 200:
-            return response.json()
+            result = response.json()
+            self.device_cache.put(user_id, device_type, result, generation)
+            if not device_type:
+                self.device_mirror.seed(user_id, result.get("devices") or [])
+            return result
         return {"devices": [], "error": "Failed to fetch devices"}
 
     async def _tool_get_device_status(self, user_id: str, args: Dict) -> Dict:
         """Get single device status."""
         device_id = args.get("device_id")
-        url = f"{DEVICE_SERVICE_URL}/devices/{device_id}/status"
-        response = await self.http_client.get(url, headers={"X-User-ID": user_id})
-        if response.status_code == 200:
-            return response.json()
-        return {"error": "Device not found"}
+        mirrored = self.device_mirror.status(user_id, device_id)
+        if mirrored is not None:
+            device_mirror_reads.labels(call="get_device_status").inc()
+            return mirrored
+
+        cached = self.status_cache.get(user_id, device_id)
+        if cached is not None:
+            status, age = cached
+            if age > STATUS_CACHE_FRESH_SECONDS:
+                self._refresh_status(user_id, device_id)
+            return {**status, "age_seconds": round(age, 1)}
+
+        try:
+            result = await self._fetch_device_status(user_id, device_id)
+        except (CircuitOpenError, httpx.TransportError) as e:
+            logger.warning(f"device-service unavailable for status of {device_id}: {e}")
+            result = self._stale_status(user_id, device_id)
+            if result is None:
+                return {"error": "Device service unavailable"}
+        return result if result is not None else {"error": "Device not found"}
+
+    def _refresh_status(self, user_id: str, device_id: str):
+        """Revalidate a cached status in the background; failures just leave the old entry."""
+        async def refresh():
+            try:
+                await self._fetch_device_status(user_id, device_id)
+            except Exception as e:
+                logger.warning(f"Background status refresh of {device_id} failed: {e}")
+
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    def _stale_status(self, user_id: str, device_id: str) -> Optional[Dict]:
+        """Last known status of a device from the status cache or the catalog, marked stale."""
+        cached = self.status_cache.get(user_id, device_id, max_age=float("inf"))
+        if cached is not None:
+            return {**cached[0], "age_seconds": round(cached[1], 1), "stale": True}
+        catalog = self.device_cache.get_stale(user_id) or {}
+        device = next((d for d in catalog.get("devices") or [] if d.get("id") == device_id), None)
+        if device is None:
+            return None
+        status = _status_from_device(device, best_effort=True)
+        status["stale"] = True
+        age = self.device_cache.age(user_id)
+        if age is not None:
+            status["age_seconds"] = round(age, 1)
+        return status
+
+    async def _fetch_device_status(self, user_id: str, device_id: str) -> Optional[Dict]:
+        """GET /devices/{id}/status, coalesced with identical in-flight reads; fills the status cache."""
+        async def fetch():
+            generation = self.status_cache.generation(user_id, device_id)
+            url = f"{DEVICE_SERVICE_URL}/devices/{device_id}/status"
+            response = await self._device_request("GET", url, headers={"X-User-ID": user_id})
+            if response.status_code == 200:
+                result = response.json()
+                self.status_cache.put(user_id, device_id, result, generation)
+                return result
+            return None
+
+        result = await self.device_reads.do("get_device_status", ("get_device_status", user_id, device_id), fetch)
+        # Callers that joined the read share the cached payload; each gets its own copy with the age
+        return {**result, "age_seconds": 0.0} if result is not None else None
 
     async def _tool_get_all_device_statuses(self, user_id: str, args: Dict) -> Dict:
         """Get status of ALL devices in one call - much more efficient."""
+        mirrored = self.device_mirror.statuses(user_id)
+        if mirrored is not None:
+            device_mirror_reads.labels(call="get_all_device_statuses").inc()
+            return {"statuses": mirrored, "count": len(mirrored)}
+
         # First get all devices
         devices_response = await self._tool_list_devices(user_id, {})
         devices = devices_response.get("devices", [])
@@ -716,33 +3508,72 @@ Be concise. Execute actions immediately without asking for confirmation."""
         if not devices:
             return {"statuses": []}
 
-        # Get status for each device concurrently
+        # The list response already carries config and last_seen, so most statuses need
+        # no extra request; the rest are fetched with bounded concurrency
+        statuses = [_status_from_device(d) for d in devices]
+        catalog_age = round(self.device_cache.age(user_id) or 0.0, 1)
+        for status in statuses:
+            if status is not None:
+                status["age_seconds"] = catalog_age
+        semaphore = asyncio.Semaphore(STATUS_FETCH_CONCURRENCY)
+
         async def get_status(device):
             try:
-                url = f"{DEVICE_SERVICE_URL}/devices/{device['id']}/status"
-                response = await self.http_client.get(url, headers={"X-User-ID": user_id})
-                if response.status_code == 200:
-                    return response.json()
+                async with semaphore:
+                    result = await self._fetch_device_status(user_id, device["id"])
+                if result is not None:
+                    return result
                 return {"name": device.get("name"), "status": "unknown", "error": "Failed to get status"}
+            except (CircuitOpenError, httpx.TransportError):
+                stale = self._stale_status(user_id, device["id"])
+                if stale is not None:
+                    return stale
+                return {"name": device.get("name"), "status": "unknown", "error": "Device service unavailable"}
             except Exception as e:
                 return {"name": device.get("name"), "status": "error", "error": str(e)}
 
-        statuses = await asyncio.gather(*[get_status(d) for d in devices])
-        return {"statuses": list(statuses), "count": len(statuses)}
+        missing = [i for i, status in enumerate(statuses) if status is None]
+        fetched = await asyncio.gather(*[get_status(devices[i]) for i in missing])
+        for i, status in zip(missing, fetched):
+            statuses[i] = status
+
+        result = {"statuses": statuses, "count": len(statuses)}
+        if devices_response.get("stale") or any(s.get("stale") for s in statuses):
+            result["stale"] = True
+        return result
 
     async def _tool_send_device_command(self, user_id: str, args: Dict) -> Dict:
         """Send command to device."""
         device_id = args.get("device_id")
         url = f"{DEVICE_SERVICE_URL}/devices/{device_id}/command"
 
-        response = await self.http_client.post(
-            url,
-            json={"command": args.get("command"), "payload": args.get("parameters", {})},
-            headers={"X-User-ID": user_id}
-        )
+        try:
+            response = await self._device_request(
+                "POST", url,
+                json={"command": args.get("command"), "payload": args.get("parameters", {})},
+                headers={"X-User-ID": user_id}
+            )
+        except CircuitOpenError:
+            return {"success": False, "error": "Device service is unavailable. Please try again shortly."}
+        except httpx.TransportError as e:
+            # The command may or may not have landed
+            logger.error(f"Command {args.get('command')} to {device_id} failed: {e}")
+            self.device_cache.invalidate(user_id)
+            self.status_cache.invalidate(user_id, device_id)
+            return {"success": False, "error": "Failed to send command"}
 
         if response.status_code in [200, 202]:
+            self.device_cache.apply_command(user_id, device_id, args.get("command"), args.get("parameters"))
+            self.status_cache.apply_command(user_id, device_id, args.get("command"), args.get("parameters"))
+            self.device_mirror.apply_command(user_id, device_id, args.get("command"), args.get("parameters"))
+            if self.device_events is None:
+                # No event feed to deliver device-service's command event, so count it here
+                self.analytics.record(user_id, device_id, EVENT_KIND_COMMAND)
             return {"success": True, "message": f"Command '{args.get('command')}' executed"}
+
+        # Device may have been removed or changed - don't trust the cached catalog
+        self.device_cache.invalidate(user_id)
+        self.status_cache.invalidate(user_id, device_id)
         return {"success": False, "error": "Failed to send command"}
 
     async def _tool_create_automation(self, user_id: str, args: Dict) -> Dict:
@@ -751,19 +3582,23 @@ Be concise. Execute actions immediately without asking for confirmation."""
         return {"success": True, "message": f"Automation '{args.get('name')}' created", "id": str(uuid4())}
 
     async def _tool_get_analytics(self, user_id: str, args: Dict) -> Dict:
-        """Get analytics summary."""
+        """Get analytics summary from the in-memory event store."""
+        period = args.get("period") if args.get("period") in ANALYTICS_PERIOD_SECONDS else "day"
+        summary = self.analytics.summary(user_id, period)
+
+        # Names come from whatever catalog is already in memory; no device-service call for a label
+        catalog = self.device_mirror.catalog(user_id) or self.device_cache.get_stale(user_id) or {}
+        names = {d.get("id"): d.get("name") for d in catalog.get("devices") or []}
         return {
-            "period": args.get("period", "day"),
+            "period": period,
             "summary": {
-                "total_events": 142,
-                "active_devices": 8,
-                "alerts": 3,
-                "energy_usage": "12.5 kWh"
+                "total_events": summary["total_events"],
+                "active_devices": summary["active_devices"],
+                "alerts": summary["alerts"],
             },
             "top_devices": [
-                {"name": "Living Room Camera", "events": 45},
-                {"name": "Front Door Sensor", "events": 32},
-                {"name": "Thermostat", "events": 28}
+                {"name": names.get(device_id) or device_id, "events": events}
+                for device_id, events in summary["top_devices"]
             ]
         }
 
@@ -785,9 +3620,20 @@ Be concise. Execute actions immediately without asking for confirmation."""
 agent = AgenticAI()
 
 
+@app.on_event("startup")
+async def startup():
+    if state_client:
+        await state_client.start()
+    await conversation_store.start()
+    await agent.start()
+
+
 @app.on_event("shutdown")
 async def shutdown():
     await agent.close()
+    await conversation_store.close()
+    if state_client:
+        await state_client.close()
 
 
 @app.get("/health")
@@ -803,13 +3649,39 @@ async def metrics():
 @app.post("/agent/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    x_user_id: str = Header(..., alias="X-User-ID")
+    response: Response,
+    x_user_id: str = Header(..., alias="X-User-ID"),
+    x_debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings")
 ):
     """Process a chat message from the user."""
-    return await agent.chat(
+    result = await agent.chat(
         user_id=x_user_id,
         message=request.message,
-        conversation_id=request.conversation_id
+        conversation_id=request.conversation_id,
+        debug=bool(x_debug_timings)
+    )
+    response.headers["X-Agent-Route"] = request_route.get()
+    if result.timings:
+        response.headers["Server-Timing"] = _server_timing(result.timings)
+    return result
+
+
+@app.post("/agent/stream")
+async def chat_stream(
+    request: ChatRequest,
+    x_user_id: str = Header(..., alias="X-User-ID"),
+    x_debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings")
+):
+    """Process a chat message, streaming progress as server-sent events."""
+    return StreamingResponse(
+        agent.chat_stream(
+            user_id=x_user_id,
+            message=request.message,
+            conversation_id=request.conversation_id,
+            debug=bool(x_debug_timings)
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
@@ -819,16 +3691,16 @@ async def get_history(
     x_user_id: str = Header(..., alias="X-User-ID")
 ):
     """Get conversation history."""
-    if conversation_id not in conversations:
+    messages = await conversation_store.history(conversation_id, x_user_id)
+    if not messages:
         return {"messages": []}
-    return {"conversation_id": conversation_id, "messages": conversations[conversation_id]}
+    return {"conversation_id": conversation_id, "messages": messages}
 
 
 @app.delete("/agent/history")
 async def clear_history(x_user_id: str = Header(..., alias="X-User-ID")):
     """Clear all conversation history for the user."""
-    # Clear all conversations (in production, filter by user_id)
-    conversations.clear()
+    await conversation_store.clear_user(x_user_id)
     return {"status": "ok", "message": "History cleared"}
 
 
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+DAY = 86400
+
+
+class DeviceAnalyticsStoreTest(unittest.TestCase):
+    def test_expired_events_dropped_on_write(self):
+        store = main.DeviceAnalyticsStore(10, 1000, retention=2 * DAY)
+        now = time.time()
+        for i in range(5):
+            store.record("u1", "dev-1", main.EVENT_KIND_EVENT, now - 10 * DAY + i)
+        store.record("u1", "dev-2", main.EVENT_KIND_ALERT, now)
+
+        self.assertEqual(store._users["u1"].size, 1)
+
+    def test_query_ignores_events_past_retention(self):
+        store = main.DeviceAnalyticsStore(10, 1000, retention=2 * DAY)
+        now = time.time()
+        store.record("u1", "dev-1", main.EVENT_KIND_EVENT, now - 5 * DAY)
+        store.record("u1", "dev-2", main.EVENT_KIND_ALERT, now - 3 * DAY)
+        store.record("u1", "dev-3", main.EVENT_KIND_EVENT, now - DAY / 2)
+
+        summary = store.summary("u1", "week")
+        self.assertEqual(summary["total_events"], 1)
+        self.assertEqual(summary["alerts"], 0)
+        self.assertEqual(summary["top_devices"], [("dev-3", 1)])
+
+    def test_out_of_order_writes_sort_only_on_read(self):
+        store = main.DeviceAnalyticsStore(10, 1000, retention=2 * DAY)
+        now = time.time()
+        for offset in (10, 30, 20, 5):
+            store.record("u1", f"dev-{offset}", main.EVENT_KIND_EVENT, now - offset * 3600)
+        columns = store._users["u1"]
+        self.assertFalse(columns.sorted)
+        self.assertEqual(columns.oldest, now - 30 * 3600)
+
+        self.assertEqual(store.summary("u1", "day")["total_events"], 3)
+        self.assertTrue(columns.sorted)
+        self.assertEqual(list(columns.ts[:columns.size]), sorted(columns.ts[:columns.size]))
+
+    def test_event_feed_without_mirror(self):
+        async def run():
+            store = main.DeviceAnalyticsStore(10, 1000, retention=2 * DAY)
+            consumer = main.DeviceEventConsumer(None, store, "local")
+            await consumer.start()
+            consumer.producer.device_event("u1", "dev-1", "motion_detected")
+            consumer.producer.device_event("u1", "dev-1", "intrusion", topic=main.KAFKA_ALERTS_TOPIC)
+            await asyncio.sleep(0.01)
+            await consumer.close()
+            return store.summary("u1", "day")
+
+        summary = asyncio.run(run())
+        self.assertEqual((summary["total_events"], summary["alerts"]), (2, 1))
+
+    def test_command_event_counted(self):
+        store = main.DeviceAnalyticsStore(10, 1000, retention=2 * DAY)
+        store.record_event(main.KAFKA_DEVICE_EVENTS_TOPIC, {
+            "type": "device_command", "user_id": "u1", "device_id": "dev-1", "command": "turn_on",
+            "timestamp": "not a timestamp",
+        })
+        self.assertEqual(store.summary("u1", "day")["total_events"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+class ChatResponseTest(unittest.TestCase):
+    def make(self, **kwargs):
+        return main.ChatResponse(id="r-1", conversation_id="c-1", message="hi", timestamp="t", **kwargs)
+
+    def test_timings_omitted_unless_requested(self):
+        body = json.loads(self.make().model_dump_json())
+        self.assertNotIn("timings", body)
+        self.assertIsNone(body["error"])
+
+    def test_requested_timings_serialized(self):
+        body = json.loads(self.make(timings={"total": 1.5}).model_dump_json())
+        self.assertEqual(body["timings"], {"total": 1.5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(main.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = main.CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+
+    def trip(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()  # Resets the run
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, main.CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, main.CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_probe_through(self):
+        self.trip()
+        self.now += 9
+        self.assertFalse(self.breaker.allow())
+
+        self.now += 2
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, main.CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())  # Probe still in flight
+
+    def test_probe_success_closes(self):
+        self.trip()
+        self.now += 11
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, main.CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_probe_failure_reopens(self):
+        self.trip()
+        self.now += 11
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, main.CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now += 11
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_probe_is_replaced(self):
+        self.trip()
+        self.now += 11
+        self.assertTrue(self.breaker.allow())  # This probe never reports back
+        self.now += 5
+        self.assertFalse(self.breaker.allow())
+        self.now += 6
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
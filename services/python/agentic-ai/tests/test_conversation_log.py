@@ -0,0 +1,148 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def message(text):
+    return {"role": "user", "parts": [{"text": text}]}
+
+
+def texts(history):
+    return [m["parts"][0]["text"] for m in history]
+
+
+class LogConversationStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, segment_bytes=1 << 20, max_messages=50):
+        return main.LogConversationStore(self.dir, segment_bytes, 3600, 0.5, max_messages, 100, 1 << 20, 3600)
+
+    async def reopen(self, **kwargs):
+        store = self.store(**kwargs)
+        await store.start()
+        return store
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.dir) if name.endswith(".log"))
+
+    def test_restart_recovers_history_and_owner(self):
+        async def test():
+            store = await self.reopen()
+            for i in range(3):
+                await store.append("c1", "u1", message(f"one {i}"))
+            await store.append("c2", "u2", message("two"))
+            await store.close()
+
+            store = await self.reopen()
+            try:
+                self.assertEqual(texts(await store.history("c1", "u1")), ["one 0", "one 1", "one 2"])
+                self.assertEqual(texts(await store.history("c2", "u2")), ["two"])
+                with self.assertRaises(PermissionError):
+                    await store.append("c1", "u2", message("not yours"))
+            finally:
+                await store.close()
+
+        asyncio.run(test())
+
+    def test_truncated_final_record_is_dropped(self):
+        async def test():
+            store = await self.reopen()
+            for i in range(3):
+                await store.append("c1", "u1", message(f"turn {i}"))
+            await store.close()
+
+            [segment] = self.segments()
+            path = os.path.join(self.dir, segment)
+            with open(path, "r+b") as f:
+                f.truncate(os.path.getsize(path) - 5)  # Crash mid-write of the last record
+
+            store = await self.reopen()
+            self.assertEqual(texts(await store.history("c1", "u1")), ["turn 0", "turn 1"])
+            await store.append("c1", "u1", message("after crash"))
+            await store.close()
+
+            store = await self.reopen()
+            try:
+                self.assertEqual(texts(await store.history("c1", "u1")), ["turn 0", "turn 1", "after crash"])
+            finally:
+                await store.close()
+
+        asyncio.run(test())
+
+    def test_deleted_conversations_stay_deleted_after_restart(self):
+        async def test():
+            store = await self.reopen()
+            await store.append("c1", "u1", message("gone"))
+            await store.append("c2", "u2", message("kept"))
+            self.assertEqual(await store.clear_user("u1"), 1)
+            await store.close()
+
+            store = await self.reopen()
+            try:
+                self.assertEqual(await store.history("c1", "u1"), [])
+                self.assertEqual(texts(await store.history("c2", "u2")), ["kept"])
+                # The id is free again and starts empty
+                await store.append("c1", "u3", message("new owner"))
+                self.assertEqual(texts(await store.history("c1", "u3")), ["new owner"])
+            finally:
+                await store.close()
+
+        asyncio.run(test())
+
+    def test_compaction_keeps_latest_turns(self):
+        async def test():
+            # Tiny segments and two-message conversations, so most records become garbage
+            store = await self.reopen(segment_bytes=256, max_messages=2)
+            for i in range(20):
+                await store.append("c1", "u1", message(f"a {i}"))
+                await store.append("c2", "u2", message(f"b {i}"))
+            await store.close()
+
+            store = await self.reopen(segment_bytes=256, max_messages=2)
+            before = self.segments()
+            shutil.copy(os.path.join(self.dir, before[0]), os.path.join(self.dir, "saved"))
+            await store.compact(force=True)
+            [compacted] = self.segments()
+            self.assertEqual(compacted, f"{before[0][:8]}-{before[-1][:8]}.log")
+            self.assertEqual(texts(await store.history("c1", "u1")), ["a 18", "a 19"])
+            await store.close()
+
+            # A crash after the compacted file landed but before old segments were deleted
+            os.rename(os.path.join(self.dir, "saved"), os.path.join(self.dir, before[0]))
+
+            store = await self.reopen(segment_bytes=256, max_messages=2)
+            try:
+                self.assertEqual(self.segments(), [compacted])
+                self.assertEqual(texts(await store.history("c1", "u1")), ["a 18", "a 19"])
+                self.assertEqual(texts(await store.history("c2", "u2")), ["b 18", "b 19"])
+            finally:
+                await store.close()
+
+        asyncio.run(test())
+
+    def test_second_process_cannot_open_the_directory(self):
+        async def test():
+            store = await self.reopen()
+            try:
+                with self.assertRaises(RuntimeError):
+                    await self.store().start()
+            finally:
+                await store.close()
+            await (await self.reopen()).close()  # Released on close
+
+        asyncio.run(test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+DEVICES = [
+    {"id": "dev-1", "name": "Living Room Light", "type": "light", "online": True, "config": {"power_on": True}},
+    {"id": "dev-2", "name": "Front Door Lock", "type": "smart_lock", "online": True, "config": {"locked": True}},
+    {"id": "dev-3", "name": "Hallway Thermostat", "type": "thermostat", "online": True, "config": {"target_temp": 70}},
+    {"id": "dev-4", "name": "Kitchen Light", "type": "light", "online": True, "config": {"power_on": True}},
+    {"id": "dev-5", "name": "Kitchen Light 2", "type": "light", "online": True, "config": {"power_on": True}},
+]
+
+
+class DeviceNameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = main.DeviceNameIndex(DEVICES)
+
+    def test_resolves_specific_name(self):
+        self.assertEqual(self.index.resolve("turn on the living room light")["id"], "dev-1")
+        self.assertEqual(self.index.resolve("is the front door locked")["id"], "dev-2")
+
+    def test_prefers_fully_covered_name(self):
+        self.assertEqual(self.index.resolve("kitchen light")["id"], "dev-4")
+
+    def test_type_only_mention_is_ambiguous_with_several_devices(self):
+        self.assertIsNone(self.index.resolve("the light"))
+        self.assertEqual(self.index.resolve("the thermostat")["id"], "dev-3")
+
+    def test_plural_mention_is_a_group(self):
+        self.assertIsNone(self.index.resolve("lights"))
+        self.assertEqual([d["id"] for d in self.index.group("lights")], ["dev-1", "dev-4", "dev-5"])
+        self.assertEqual([d["id"] for d in self.index.group("kitchen lights")], ["dev-4", "dev-5"])
+        self.assertEqual(self.index.group("kitchen light"), [])
+
+    def test_tie_is_ambiguous(self):
+        index = main.DeviceNameIndex([
+            {"id": "a", "name": "Desk Lamp", "type": "light"},
+            {"id": "b", "name": "Desk Fan", "type": "smart_plug"},
+        ])
+        self.assertIsNone(index.resolve("desk"))
+
+    def test_fuzzy_match_uses_trigram_counts(self):
+        self.assertEqual(self.index.resolve("thermostatt")["id"], "dev-3")
+        self.assertEqual(self.index.resolve("kitchn light")["id"], "dev-4")
+        self.assertIsNone(self.index.resolve("garage"))
+
+
+class DevicePowerTest(unittest.TestCase):
+    def run_chat(self, message):
+        commands = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/devices":
+                device_type = request.url.params.get("type")
+                devices = [d for d in DEVICES if not device_type or d["type"] == device_type]
+                return httpx.Response(200, json={"devices": devices, "count": len(devices)})
+            if request.url.path.endswith("/command"):
+                commands.append((request.url.path.split("/")[2], json.loads(request.content)["command"]))
+                return httpx.Response(202, json={})
+            return httpx.Response(404)
+
+        async def chat():
+            agent = main.AgenticAI()
+            await agent.device_client.aclose()
+            agent.device_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                return await agent._try_local_handling("user-1", message)
+            finally:
+                await agent.close()
+
+        return asyncio.run(chat()), commands
+
+    def test_turn_off_the_lights_reaches_every_light(self):
+        result, commands = self.run_chat("turn off the lights")
+        self.assertIsNotNone(result)
+        self.assertEqual(sorted(commands), [("dev-1", "turn_off"), ("dev-4", "turn_off"), ("dev-5", "turn_off")])
+        self.assertIn("all 3", result[0])
+
+    def test_single_named_light(self):
+        result, commands = self.run_chat("turn off the living room light")
+        self.assertEqual(commands, [("dev-1", "turn_off")])
+
+    def test_ambiguous_singular_goes_to_gemini(self):
+        result, commands = self.run_chat("turn off the light")
+        self.assertIsNone(result)
+        self.assertEqual(commands, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
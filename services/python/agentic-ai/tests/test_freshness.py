@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+NOW = datetime.now(timezone.utc).isoformat()
+DEVICES = [
+    {"id": "dev-1", "name": "Living Room Light", "type": "light", "location": "Living Room",
+     "config": {"power_on": True, "brightness": 60}, "last_seen": NOW},
+    {"id": "dev-2", "name": "Front Door Lock", "type": "smart_lock", "location": "Entry"},
+]
+
+
+def run_agent(call):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/devices":
+            return httpx.Response(200, json={"devices": DEVICES, "count": len(DEVICES)})
+        if request.url.path.endswith("/status"):
+            device = next(d for d in DEVICES if d["id"] == request.url.path.split("/")[2])
+            return httpx.Response(200, json={"device_id": device["id"], "name": device["name"],
+                                             "type": device["type"], "location": device["location"],
+                                             "state": "locked", "online": True})
+        return httpx.Response(404)
+
+    async def go():
+        agent = main.AgenticAI()
+        await agent.device_client.aclose()
+        agent.device_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await call(agent)
+        finally:
+            await agent.close()
+
+    return asyncio.run(go())
+
+
+class FreshnessTest(unittest.TestCase):
+    def test_fresh_fetch_reports_zero_age(self):
+        result = run_agent(lambda agent: agent._tool_get_device_status("user-1", {"device_id": "dev-2"}))
+        self.assertEqual(result["age_seconds"], 0.0)
+
+    def test_every_status_path_renders_freshness(self):
+        async def call(agent):
+            statuses = await agent._tool_get_all_device_statuses("user-1", {})
+            single = await agent._tool_get_device_status("user-1", {"device_id": "dev-2"})
+            return statuses, single, agent
+
+        statuses, single, agent = run_agent(call)
+        self.assertTrue(all(s["age_seconds"] is not None for s in statuses["statuses"]))
+        self.assertIn("_Updated just now_", agent._format_all_device_statuses(statuses))
+        self.assertIn("_Updated just now_", agent._format_single_device_status(DEVICES[1], single))
+        gemini_reply = agent._generate_response_from_actions(
+            [{"tool": "get_device_status", "args": {"device_id": "dev-2"}, "result": single}]
+        )
+        self.assertEqual(gemini_reply, "**Front Door Lock**: locked\n_Updated just now_")
+
+    def test_mirror_reports_age_since_seed_or_last_event(self):
+        mirror = main.DeviceStateMirror(10, reseed_after=300)
+        mirror.set_live(True)
+        mirror.seed("user-1", DEVICES)
+        # Pretend the seed happened 200s ago, as if a PUT had changed config since without an event
+        seeded_at, devices, updated = mirror._users["user-1"]
+        mirror._users["user-1"] = (seeded_at, devices, {device_id: time.monotonic() - 200 for device_id in updated})
+
+        status = mirror.status("user-1", "dev-1")
+        self.assertGreaterEqual(status["age_seconds"], 200)
+        self.assertEqual(main._freshness_lines(status["age_seconds"], False), ["_Updated 3 min ago_"])
+
+        mirror.apply_event(main.KAFKA_HEARTBEATS_TOPIC, {"user_id": "user-1", "device_id": "dev-1", "timestamp": NOW})
+        self.assertLess(mirror.status("user-1", "dev-1")["age_seconds"], 1)
+        ages = {s["device_id"]: s["age_seconds"] for s in mirror.statuses("user-1")}
+        self.assertGreaterEqual(ages["dev-2"], 200)
+
+    def test_stale_result_shows_age_and_warning(self):
+        lines = main._freshness_lines(300, stale=True)
+        self.assertEqual(lines, ["_Updated 5 min ago_", main.STALE_DATA_NOTE])
+
+
+if __name__ == "__main__":
+    unittest.main()
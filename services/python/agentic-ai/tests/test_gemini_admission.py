@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+class GeminiAdmissionControllerTest(unittest.TestCase):
+    def test_burst_then_empty(self):
+        admission = main.GeminiAdmissionController(rate=0.001, burst=3, max_queue=10)
+        self.assertEqual([admission.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    def test_tokens_refill_at_rate(self):
+        async def test():
+            admission = main.GeminiAdmissionController(rate=50, burst=1, max_queue=10)
+            self.assertTrue(admission.try_acquire())
+            started = time.monotonic()
+            self.assertTrue(await admission.acquire(time.monotonic() + 1))
+            return time.monotonic() - started
+
+        waited = asyncio.run(test())
+        self.assertGreaterEqual(waited, 0.015)  # One token every 20 ms
+        self.assertLess(waited, 0.5)
+
+    def test_refill_is_capped_at_burst(self):
+        admission = main.GeminiAdmissionController(rate=1000, burst=2, max_queue=10)
+        admission._updated -= 10
+        self.assertEqual([admission.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_shed_when_wait_would_pass_deadline(self):
+        async def test():
+            admission = main.GeminiAdmissionController(rate=1, burst=1, max_queue=10)
+            admission.try_acquire()
+            started = time.monotonic()
+            admitted = await admission.acquire(time.monotonic() + 0.1)
+            return admitted, time.monotonic() - started
+
+        admitted, elapsed = asyncio.run(test())
+        self.assertFalse(admitted)
+        self.assertLess(elapsed, 0.05)  # Shed up front, not after waiting out the deadline
+
+    def test_shed_when_queue_full(self):
+        async def test():
+            admission = main.GeminiAdmissionController(rate=10, burst=1, max_queue=1)
+            admission.try_acquire()
+            waiter = asyncio.create_task(admission.acquire(time.monotonic() + 5))
+            await asyncio.sleep(0)
+            rejected = await admission.acquire(time.monotonic() + 5)
+            return rejected, await waiter
+
+        self.assertEqual(asyncio.run(test()), (False, True))
+
+    def test_first_attempts_admitted_before_retries(self):
+        async def test():
+            admission = main.GeminiAdmissionController(rate=20, burst=1, max_queue=10)
+            admission.try_acquire()
+            order = []
+
+            async def request(name, priority):
+                await admission.acquire(time.monotonic() + 5, priority=priority)
+                order.append(name)
+
+            retry = asyncio.create_task(request("retry", 1))
+            await asyncio.sleep(0)
+            first = asyncio.create_task(request("first", 0))
+            await asyncio.gather(retry, first)
+            return order
+
+        self.assertEqual(asyncio.run(test()), ["first", "retry"])
+
+
+if __name__ == "__main__":
+    unittest.main()
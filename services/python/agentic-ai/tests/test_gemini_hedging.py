@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+HEDGE_AFTER = 0.05
+
+
+class GeminiHedgingTest(unittest.TestCase):
+    def post(self, delays, timeout=2.0, tokens=10):
+        """POST through _post_gemini; request n takes delays[n] seconds."""
+        requests, cancelled = [], []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            index = len(requests)
+            requests.append(request.extensions["timeout"]["read"])
+            try:
+                await asyncio.sleep(delays[index])
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+            return httpx.Response(200, json={"request": index})
+
+        async def run():
+            agent = main.AgenticAI()
+            await agent.gemini_client.aclose()
+            agent.gemini_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            agent.gemini_latency.percentile = lambda pct, min_samples: HEDGE_AFTER
+            agent.gemini_admission = main.GeminiAdmissionController(0.001, tokens, 10)
+            try:
+                response = await agent._post_gemini("https://gemini.test/v1:generateContent", b"{}", timeout)
+                await asyncio.sleep(0.01)  # Let the loser's cancellation land
+                return response.json()["request"]
+            finally:
+                await agent.close()
+
+        with mock.patch.object(main, "GEMINI_HEDGE_PERCENTILE", 95):
+            winner = asyncio.run(run())
+        return winner, requests, cancelled
+
+    def test_fast_primary_sends_no_hedge(self):
+        winner, requests, _ = self.post([0.0])
+        self.assertEqual((winner, len(requests)), (0, 1))
+
+    def test_hedge_wins_and_primary_is_cancelled(self):
+        winner, requests, cancelled = self.post([1.0, 0.0])
+        self.assertEqual((winner, len(requests), cancelled), (1, 2, [0]))
+
+    def test_primary_wins_and_hedge_is_cancelled(self):
+        winner, requests, cancelled = self.post([0.1, 1.0])
+        self.assertEqual((winner, len(requests), cancelled), (0, 2, [1]))
+
+    def test_no_hedge_without_spare_admission_token(self):
+        winner, requests, _ = self.post([0.1, 0.0], tokens=0)
+        self.assertEqual((winner, len(requests)), (0, 1))
+
+    def test_hedge_timeout_clamped_to_remaining_time(self):
+        _, timeouts, _ = self.post([1.0, 0.0], timeout=0.5)
+        primary, hedge = timeouts
+        self.assertLessEqual(primary, 0.5)
+        self.assertLessEqual(hedge, 0.5 - HEDGE_AFTER + 0.01)
+
+    def test_no_hedge_when_threshold_exceeds_timeout(self):
+        winner, requests, _ = self.post([0.06], timeout=HEDGE_AFTER)
+        self.assertEqual((winner, len(requests)), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def classify(message):
+    return [(intent.name, intent.slots) for intent in main.intent_router.classify(message.lower())]
+
+
+class IntentRouterTest(unittest.TestCase):
+    def test_analytics_period(self):
+        cases = {
+            "show my usage": "day",
+            "usage this week": "week",
+            "usage for the last two weeks": "week",
+            "weekly usage summary": "week",
+            "analytics for this month": "month",
+            "activity over the past three months": "month",
+            "monthly insights": "month",
+        }
+        for message, period in cases.items():
+            with self.subTest(message=message):
+                self.assertIn(("analytics", {"period": period}), classify(message))
+
+    def test_period_needs_whole_word(self):
+        self.assertIn(("analytics", {"period": "day"}), classify("usage of the weekend lights"))
+
+    def test_device_power_extracts_name(self):
+        self.assertEqual(classify("Turn on the kitchen light, please")[0],
+                         ("device_power", {"command": "turn_on", "device_name": "kitchen light"}))
+
+    def test_bare_power_command_falls_through(self):
+        self.assertNotIn("device_power", [name for name, _ in classify("turn off please")])
+
+    def test_list_and_all_status(self):
+        self.assertEqual(classify("what devices do I have?")[0][0], "list_devices")
+        self.assertEqual(classify("status of all my devices")[0][0], "all_device_status")
+
+    def test_overlapping_triggers_all_match(self):
+        # "what is the status" overlaps "status of all" / "status of my devices"
+        for message in ("what is the status of all my devices", "what is the status of my devices",
+                        "show me the status of all devices"):
+            with self.subTest(message=message):
+                self.assertEqual(classify(message)[0][0], "all_device_status")
+
+    def test_unrelated_message_has_no_intent(self):
+        self.assertEqual(classify("make the place cozy for a movie night"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+DEVICES = [{"id": "dev-1", "name": "Porch Light", "type": "light", "online": True, "config": {"power_on": False}}]
+PLAN = {"candidates": [{"content": {"parts": [
+    {"functionCall": {"name": "send_device_command", "args": {"device_id": "dev-1", "command": "turn_on"}}},
+]}}]}
+MESSAGE = "get the house ready for the evening"
+
+
+class ColdCatalogPlanCacheTest(unittest.TestCase):
+    def test_plan_cache_hit_skips_gemini_when_catalog_expired(self):
+        gemini_requests = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path.endswith(":generateContent"):
+                gemini_requests.append(request)
+                return httpx.Response(200, json=PLAN)
+            if request.url.path == "/devices":
+                return httpx.Response(200, json={"devices": DEVICES, "count": len(DEVICES)})
+            return httpx.Response(202, json={})
+
+        async def turn(agent):
+            history = [{"role": "user", "parts": [{"text": MESSAGE}]}]
+            await agent._call_gemini_optimized("user-1", MESSAGE, history, time.monotonic() + 10)
+            return main.request_route.get()
+
+        async def run():
+            agent = main.AgenticAI()
+            for attr in ("device_client", "gemini_client"):
+                await getattr(agent, attr).aclose()
+                setattr(agent, attr, httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            # Every catalog entry is expired as soon as it is stored, like a catalog past its TTL
+            agent.device_cache = main.DeviceCatalogCache(10, ttl=0)
+            try:
+                first = await turn(agent)
+                tokens = agent.gemini_admission._tokens
+                second = await turn(agent)
+                return first, second, tokens, agent.gemini_admission._tokens
+            finally:
+                await agent.close()
+
+        first, second, tokens_before, tokens_after = asyncio.run(run())
+        self.assertEqual((first, second), ("gemini", "plan_cache"))
+        self.assertEqual(len(gemini_requests), 1)
+        self.assertGreaterEqual(tokens_after, tokens_before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+CATALOG = {"devices": [{"id": "dev-1", "name": "Porch Light", "type": "light", "config": {"power_on": False}}],
+           "count": 1}
+
+
+def settle():
+    # Lets relayed events cross the socket
+    return asyncio.sleep(0.05)
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state.sock")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def client(self):
+        return main.StateClient(self.path, lambda: main.ConversationStore(50, 100, 1 << 20, 3600))
+
+    def run_async(self, test):
+        asyncio.run(asyncio.wait_for(test(), 10))
+
+    def test_one_worker_is_elected_host(self):
+        async def test():
+            first, second = self.client(), self.client()
+            await first.start()
+            await second.start()
+            try:
+                self.assertIsNotNone(first.broker)
+                self.assertIsNone(second.broker)
+                await main.RemoteConversationStore(second).append("c1", "u1", {"role": "user", "parts": []})
+                self.assertEqual(len(await main.RemoteConversationStore(first).history("c1", "u1")), 1)
+            finally:
+                await second.close()
+                await first.close()
+
+        self.run_async(test)
+
+    def test_surviving_worker_takes_over_and_resets(self):
+        async def test():
+            host, worker = self.client(), self.client()
+            await host.start()
+            await worker.start()
+            resets = []
+            worker.subscribe("reset", lambda: resets.append(True))
+            await settle()  # The broker has registered both connections
+            try:
+                await host.close()  # The host goes away; the kernel drops its flock
+                for _ in range(100):
+                    if worker.broker is not None and worker._connected.is_set():
+                        break
+                    await asyncio.sleep(0.02)
+                self.assertIsNotNone(worker.broker)
+                self.assertEqual(resets, [True])
+                self.assertEqual(await main.RemoteConversationStore(worker).history("c1", "u1"), [])
+            finally:
+                await worker.close()
+
+        self.run_async(test)
+
+    def test_cache_writes_reach_other_workers(self):
+        async def test():
+            host, worker = self.client(), self.client()
+            await host.start()
+            await worker.start()
+            a = main.SharedDeviceCatalogCache(10, 30, host)
+            b = main.SharedDeviceCatalogCache(10, 30, worker)
+            try:
+                a.put("u1", "", CATALOG, a.generation("u1"))
+                await settle()
+                self.assertEqual(b.get("u1"), CATALOG)
+
+                b.invalidate("u1")
+                await settle()
+                self.assertIsNone(a.get("u1"))
+            finally:
+                await worker.close()
+                await host.close()
+
+        self.run_async(test)
+
+    def test_slow_peer_is_disconnected(self):
+        async def test():
+            host, sender = self.client(), self.client()
+            await host.start()
+            await sender.start()
+            # A peer that connects and never reads
+            _, stuck = await asyncio.open_unix_connection(self.path)
+            await settle()
+            try:
+                with mock.patch.object(main, "STATE_PEER_DRAIN_TIMEOUT_SECONDS", 0.1):
+                    for _ in range(40):
+                        sender.publish("device_cache", "noop", "u1", "x" * 100_000)
+                    for _ in range(100):
+                        if len(host.broker._writers) == 2:
+                            break
+                        await asyncio.sleep(0.05)
+                self.assertEqual(len(host.broker._writers), 2)
+            finally:
+                stuck.close()
+                await sender.close()
+                await host.close()
+
+        self.run_async(test)
+
+
+class _Bus:
+    """In-memory StateClient stand-in: publish() delivers to every other subscriber when flushed."""
+
+    def __init__(self):
+        self.members = []
+        self.queued = []
+
+    def join(self):
+        bus = self
+
+        class Member:
+            def __init__(self):
+                self.handlers = {}
+                bus.members.append(self)
+
+            def subscribe(self, event, handler):
+                self.handlers[event] = handler
+
+            def publish(self, event, *args):
+                bus.queued.append((self, event, json.loads(json.dumps(args))))
+
+        return Member()
+
+    def flush(self):
+        queued, self.queued = self.queued, []
+        for sender, event, args in queued:
+            for member in self.members:
+                if member is not sender:
+                    member.handlers[event](*args)
+
+
+class SharedCatalogGenerationTest(unittest.TestCase):
+    def test_remote_put_fetched_before_local_command_is_dropped(self):
+        bus = _Bus()
+        a = main.SharedDeviceCatalogCache(10, 30, bus.join())
+        b = main.SharedDeviceCatalogCache(10, 30, bus.join())
+        b.put("u1", "", json.loads(json.dumps(CATALOG)), b.generation("u1"))
+        bus.flush()
+
+        # Worker A starts a fetch; meanwhile B turns the light on and patches its copy
+        generation = a.generation("u1")
+        b.apply_command("u1", "dev-1", "turn_on", None)
+        a.put("u1", "", json.loads(json.dumps(CATALOG)), generation)  # A's response predates the command
+        bus.flush()
+
+        self.assertTrue(b.get("u1")["devices"][0]["config"]["power_on"])
+
+    def test_remote_put_after_last_write_is_applied(self):
+        bus = _Bus()
+        a = main.SharedDeviceCatalogCache(10, 30, bus.join())
+        b = main.SharedDeviceCatalogCache(10, 30, bus.join())
+        b.invalidate("u1")
+        bus.flush()
+
+        a.put("u1", "", CATALOG, a.generation("u1"))
+        bus.flush()
+        self.assertEqual(b.get("u1"), CATALOG)
+
+
+if __name__ == "__main__":
+    unittest.main()